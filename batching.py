@@ -0,0 +1,96 @@
+import heapq
+import logging
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import time
+from typing import Any, Dict, List, Optional, Tuple
+from causality import current_trace_id, set_current_trace_id
+
+
+
+class _FlushScheduler:
+    # a single thread flushes the batches of all devices
+
+    def __init__(self):
+        self.__condition = Condition()
+        self.__deadlines: List[Tuple[float, int, Any]] = []
+        self.__seq = count()
+        self.__thread: Optional[Thread] = None
+
+    def schedule(self, deadline: float, batcher):
+        with self.__condition:
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__run, name="micro batching", daemon=True)
+                self.__thread.start()
+            heapq.heappush(self.__deadlines, (deadline, next(self.__seq), batcher))
+            self.__condition.notify()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while len(self.__deadlines) == 0 or self.__deadlines[0][0] > time():
+                    self.__condition.wait(None if len(self.__deadlines) == 0 else self.__deadlines[0][0] - time())
+                _, _, batcher = heapq.heappop(self.__deadlines)
+            try:
+                batcher.flush()
+            except Exception as e:
+                logging.warning("error occurred flushing batch of " + batcher.name + " " + str(e))
+
+
+_scheduler = _FlushScheduler()
+
+
+class MicroBatcher:
+    """
+    collects the property changes of a device over a short window and dispatches them at once. The latest
+    value of a property wins. The old value is the value before the window has been opened
+    """
+
+    def __init__(self, name: str, window_sec: float, listener):
+        self.name = name
+        self.window_sec = window_sec
+        self.__listener = listener
+        self.__lock = Lock()
+        self.__pending: Optional[Dict[str, Any]] = None
+        self.__pending_old: Dict[str, Any] = {}
+        self.__trace_id: Optional[str] = None
+        self.num_received = 0
+        self.num_dispatched = 0
+
+    @property
+    def ratio(self) -> float:
+        # received change sets per dispatch
+        return 0 if self.num_dispatched == 0 else self.num_received / self.num_dispatched
+
+    def add(self, properties: Dict[str, Any], old_properties: Dict[str, Any]):
+        with self.__lock:
+            self.num_received += 1
+            if self.__pending is None:
+                self.__pending = {}
+                self.__pending_old = {}
+                self.__trace_id = current_trace_id()
+                _scheduler.schedule(time() + self.window_sec, self)
+            for name, value in properties.items():
+                if name not in self.__pending and name in old_properties:
+                    self.__pending_old[name] = old_properties[name]
+                self.__pending[name] = value
+
+    def flush(self):
+        with self.__lock:
+            pending, pending_old, trace_id = self.__pending, self.__pending_old, self.__trace_id
+            self.__pending = None
+            self.__pending_old = {}
+            self.__trace_id = None
+        if pending is not None:
+            # a property which has been changed back within the window is unchanged
+            changed = {name: value for name, value in pending.items() if name not in pending_old or pending_old[name] != value}
+            if len(changed) > 0:
+                self.num_dispatched += 1
+                set_current_trace_id(trace_id)
+                try:
+                    self.__listener(changed, {name: value for name, value in pending_old.items() if name in changed})
+                finally:
+                    set_current_trace_id(None)
+
+    def __str__(self):
+        return self.name + ": " + str(self.num_received) + " change events in " + str(self.num_dispatched) + " dispatches (ratio " + str(round(self.ratio, 1)) + ")"
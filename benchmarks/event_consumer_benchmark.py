@@ -0,0 +1,51 @@
+import sys
+import json
+from os.path import dirname, abspath
+from time import perf_counter
+from typing import Any, Dict
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import websocket_consumer
+from websocket_consumer import EventConsumer, Listener
+
+
+# measures the decoding and dispatching of websocket messages (messages per second on a single core)
+# usage: python benchmarks/event_consumer_benchmark.py [num_messages]
+
+
+class CachingListener(Listener):
+
+    def __init__(self):
+        self.properties = {}
+
+    def on_property_changed(self, properties: Dict[str, Any]):
+        for name, value in properties.items():
+            if self.properties.get(name, None) != value:
+                self.properties[name] = value
+
+
+def messages(num_messages: int):
+    return [json.dumps({"messageType": "propertyStatus", "data": {"power": i % 500, "voltage": 230.1, "state": "on", "updated": "2024-06-01T12:00"}})
+            for i in range(num_messages)]
+
+
+def run(loads, msgs) -> float:
+    websocket_consumer.loads = loads
+    consumer = EventConsumer("bench", "http://localhost:9999", CachingListener())
+    start = perf_counter()
+    for msg in msgs:
+        consumer.on_message(msg)
+    return len(msgs) / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    msgs = messages(num_messages)
+    print("json (stdlib):  " + str(int(run(json.loads, msgs))) + " msg/sec")
+    try:
+        import orjson
+        print("orjson:         " + str(int(run(orjson.loads, msgs))) + " msg/sec")
+        print("orjson (bytes): " + str(int(run(orjson.loads, [msg.encode("utf-8") for msg in msgs]))) + " msg/sec")
+    except ImportError:
+        print("orjson not installed")
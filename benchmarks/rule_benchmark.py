@@ -0,0 +1,69 @@
+import sys
+import tracemalloc
+from os.path import dirname, abspath
+from time import perf_counter
+from types import FunctionType
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from invoke import InvokerManager, Invocation
+from property_change_processor import PropertyChangedRule
+from processor import Processor
+
+
+# measures memory and hashing overhead of rules and invocations
+# usage: python benchmarks/rule_benchmark.py [num_rules]
+
+
+class BenchmarkProcessor(Processor):
+
+    def on_annotation(self, annotation: str, func) -> bool:
+        return False
+
+
+def rule_function():
+    pass
+
+
+def new_functions(num_rules: int, num_modules: int = 100):
+    functions = []
+    for i in range(num_rules):
+        func = FunctionType(rule_function.__code__, {"__name__": "rules_" + str(i % num_modules)}, "rule_" + str(i))
+        functions.append(func)
+    return functions
+
+
+if __name__ == '__main__':
+    num_rules = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    functions = new_functions(num_rules)
+    invoker_manager = InvokerManager()
+
+    device_names = ["device" + str(i) for i in range(50)]
+    prop_names = ["prop" + str(i) for i in range(20)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rules = [PropertyChangedRule(device_names[i % 50], prop_names[i % 20], "Property device#prop changed", func, invoker_manager) for i, func in enumerate(functions)]
+    print(str(num_rules) + " rules: " + str(round((tracemalloc.get_traced_memory()[0] - before) / num_rules)) + " bytes per rule (incl. invoker)")
+
+    before = tracemalloc.get_traced_memory()[0]
+    invocations = [Invocation(rule._Rule__invoker.invoker, None, "bench") for rule in rules]
+    print(str(num_rules) + " invocations: " + str(round((tracemalloc.get_traced_memory()[0] - before) / num_rules)) + " bytes per invocation")
+    tracemalloc.stop()
+
+    processor = BenchmarkProcessor("bench", None, invoker_manager)
+    start = perf_counter()
+    for rule in rules:
+        processor.add_rule(rule)
+    print("add_rule: " + str(round((perf_counter() - start) / num_rules * 1000 * 1000, 2)) + " us per rule")
+
+    start = perf_counter()
+    for _ in range(10):
+        for rule in rules:
+            rule in processor.rules
+    print("set lookup: " + str(round((perf_counter() - start) / (10 * num_rules) * 1000 * 1000 * 1000)) + " ns per lookup")
+
+    start = perf_counter()
+    for i in range(100):
+        processor.remove_rules("rules_" + str(i))
+    print("remove_rules (100 modules): " + str(round((perf_counter() - start) * 1000, 2)) + " ms")
@@ -0,0 +1,104 @@
+import logging
+from datetime import datetime
+from threading import local, Lock
+from typing import Optional, Tuple, Dict
+
+
+
+class CausalTrace:
+
+    def __init__(self, initiator: str, chain: Tuple[str, ...]):
+        self.initiator = initiator
+        self.chain = chain
+        self.fan_out = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.chain)
+
+    def child(self, name: str):
+        self.fan_out += 1
+        return CausalTrace(self.initiator, self.chain + (name,))
+
+    def cycle(self) -> Optional[Tuple[str, ...]]:
+        # the sub chain starting with the previous occurrence of the latest rule, if the latest rule is called recursively
+        latest = self.chain[-1]
+        for i in range(len(self.chain) - 2, -1, -1):
+            if self.chain[i] == latest:
+                return self.chain[i:]
+        return None
+
+    def __str__(self):
+        return self.initiator + " -> " + " -> ".join(self.chain)
+
+
+_context = local()
+
+
+def current_trace() -> Optional[CausalTrace]:
+    return getattr(_context, 'trace', None)
+
+
+def set_current_trace(trace: Optional[CausalTrace]):
+    _context.trace = trace
+
+
+def current_trace_id() -> Optional[str]:
+    # the id of the latency trace (see tracing), if the causing event is sampled
+    return getattr(_context, 'trace_id', None)
+
+
+def set_current_trace_id(trace_id: Optional[str]):
+    _context.trace_id = trace_id
+
+
+class CascadeMonitor:
+
+    def __init__(self, max_depth: int = 8, report_interval_sec: int = 60):
+        self.max_depth = max_depth
+        self.report_interval_sec = report_interval_sec
+        self.__lock = Lock()
+        self.__reported_cycles: Dict[Tuple[str, ...], datetime] = {}
+        self.num_cascaded = 0
+        self.num_dropped = 0
+        self.num_cycles = 0
+        self.max_depth_seen = 0
+        self.max_fan_out = 0
+        self.__num_fan_outs = 0
+        self.__sum_fan_outs = 0
+
+    def admit(self, trace: CausalTrace) -> bool:
+        if trace.depth <= 1:
+            return True
+        with self.__lock:
+            self.num_cascaded += 1
+            self.max_depth_seen = max(self.max_depth_seen, trace.depth)
+            cycle = trace.cycle()
+            if cycle is not None:
+                self.num_cycles += 1
+                last_reported = self.__reported_cycles.get(cycle, None)
+                if last_reported is None or (datetime.now() - last_reported).total_seconds() > self.report_interval_sec:
+                    self.__reported_cycles[cycle] = datetime.now()
+                    logging.warning("rule cycle detected: " + " -> ".join(cycle) + " (" + str(trace) + ")")
+            if trace.depth > self.max_depth:
+                self.num_dropped += 1
+                logging.warning("reject invoking " + trace.chain[-1] + ". Max cascade depth " + str(self.max_depth) + " exceeded (" + str(trace) + ")")
+                return False
+        return True
+
+    def on_completed(self, trace: CausalTrace):
+        if trace.fan_out > 0:
+            with self.__lock:
+                self.max_fan_out = max(self.max_fan_out, trace.fan_out)
+                self.__num_fan_outs += 1
+                self.__sum_fan_outs += trace.fan_out
+
+    @property
+    def avg_fan_out(self) -> float:
+        if self.__num_fan_outs == 0:
+            return 0
+        return self.__sum_fan_outs / self.__num_fan_outs
+
+    def __str__(self):
+        return "cascaded: " + str(self.num_cascaded) + ", dropped: " + str(self.num_dropped) + ", cycles: " + str(self.num_cycles) + \
+               ", max depth: " + str(self.max_depth_seen) + ", fan-out avg: " + str(round(self.avg_fan_out, 2)) + " max: " + str(self.max_fan_out)
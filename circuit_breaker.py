@@ -0,0 +1,95 @@
+import logging
+from datetime import datetime, timedelta
+from threading import Lock, BoundedSemaphore
+
+
+
+class CircuitBreaker:
+    """
+    health state of a device. After consecutive failures the breaker is opened and requests fail fast.
+    While open, the device is probed in the background (see probe_due). The number of concurrent
+    requests is limited. Further requests wait for a free slot, but not longer than a request may take
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+
+    def __init__(self, name: str, failure_threshold: int = 3, open_interval_sec: int = 30, max_open_interval_sec: int = 10 * 60, max_in_flight: int = 2, max_wait_sec: float = 10):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_interval_sec = open_interval_sec
+        self.max_open_interval_sec = max_open_interval_sec
+        self.max_in_flight = max_in_flight
+        self.max_wait_sec = max_wait_sec
+        self.__in_flight_slots = BoundedSemaphore(max_in_flight)
+        self.__lock = Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.in_flight = 0
+        self.num_rejected = 0
+        self.__interval_sec = open_interval_sec
+        self.__next_probe = datetime.now()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    @property
+    def is_healthy(self) -> bool:
+        return self.state == self.CLOSED and self.consecutive_failures == 0
+
+    def acquire(self, probe: bool = False) -> bool:
+        # returns False, if the request has to fail fast (the breaker is open) or no slot got free in time. Probes pass an open breaker
+        if self.state == self.OPEN and not probe:
+            with self.__lock:
+                self.num_rejected += 1
+            return False
+        if not self.__in_flight_slots.acquire(timeout=self.max_wait_sec):
+            # the pending requests do not complete in time
+            with self.__lock:
+                self.num_rejected += 1
+                self.__on_result(False, probe)
+            return False
+        with self.__lock:
+            if self.state == self.OPEN and not probe:
+                # opened while waiting for the slot
+                self.num_rejected += 1
+                self.__in_flight_slots.release()
+                return False
+            self.in_flight += 1
+        return True
+
+    def release(self, succeeded: bool, probe: bool = False):
+        with self.__lock:
+            self.in_flight -= 1
+            self.__on_result(succeeded, probe)
+        self.__in_flight_slots.release()
+
+    def __on_result(self, succeeded: bool, probe: bool):
+        if succeeded:
+            if self.state == self.OPEN:
+                logging.info(self.name + " is available again. Closing circuit breaker")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.__interval_sec = self.open_interval_sec
+        else:
+            self.consecutive_failures += 1
+            if self.state == self.OPEN:
+                # only a failed probe extends the backoff. Requests which have been started before opening do not
+                if probe:
+                    self.__interval_sec = min(self.__interval_sec * 2, self.max_open_interval_sec)
+                    self.__next_probe = datetime.now() + timedelta(seconds=self.__interval_sec)
+            elif self.consecutive_failures >= self.failure_threshold:
+                logging.warning(self.name + " failed " + str(self.consecutive_failures) + " times. Opening circuit breaker for " + str(self.__interval_sec) + " sec")
+                self.state = self.OPEN
+                self.__next_probe = datetime.now() + timedelta(seconds=self.__interval_sec)
+
+    def probe_due(self) -> bool:
+        return self.state == self.OPEN and datetime.now() >= self.__next_probe
+
+    def __str__(self):
+        if self.state == self.OPEN:
+            return self.state + " (" + str(self.consecutive_failures) + " failures, " + str(self.num_rejected) + " rejected, next probe in " + \
+                   str(max(0, int((self.__next_probe - datetime.now()).total_seconds()))) + " sec)"
+        else:
+            return self.state + " (" + str(self.consecutive_failures) + " failures, " + str(self.num_rejected) + " rejected, " + str(self.in_flight) + " in flight)"
@@ -0,0 +1,44 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from time import sleep
+
+
+
+class Clock(ABC):
+
+    is_virtual = False
+
+    @abstractmethod
+    def now(self) -> datetime:
+        pass
+
+    @abstractmethod
+    def sleep(self, sec: float):
+        pass
+
+
+class SystemClock(Clock):
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def sleep(self, sec: float):
+        sleep(sec)
+
+
+class VirtualClock(Clock):
+
+    is_virtual = True
+
+    def __init__(self, start: datetime):
+        self.__now = start
+
+    def now(self) -> datetime:
+        return self.__now
+
+    def sleep(self, sec: float):
+        self.advance_to(self.__now + timedelta(seconds=sec))
+
+    def advance_to(self, time: datetime):
+        if time > self.__now:
+            self.__now = time
@@ -5,6 +5,7 @@ def when(target: str):
         .. code-block::
             @when("Time cron 55 55 5 * * ?")
             @when("Property energy#pv changed")
+            @when("Inputs changed")
             @when("Rule loaded")
     Args:
         target (string): the trigger expression
@@ -1,9 +1,10 @@
 import logging
 import pycron
-from time import sleep
 from threading import Thread
 from datetime import datetime
+from typing import Optional
 from rule import Rule
+from clock import Clock, SystemClock
 from device import DeviceRegistry
 from invoke import InvokerManager
 from processor import Processor
@@ -13,6 +14,8 @@ from processor import Processor
 
 class CronRule(Rule):
 
+    __slots__ = ('cron',)
+
     def __init__(self, trigger_expression: str, cron: str, func, invoker_manager: InvokerManager):
         self.cron = cron
         super().__init__(trigger_expression, func, invoker_manager)
@@ -20,8 +23,11 @@ class CronRule(Rule):
 
 class CronProcessor(Processor):
 
-    def __init__(self, device_registry: DeviceRegistry, invoker_manager: InvokerManager):
+    TRIGGER_TYPE = "time"
+
+    def __init__(self, device_registry: DeviceRegistry, invoker_manager: InvokerManager, clock: Optional[Clock] = None):
         self.thread = Thread(target=self.__process, daemon=True)
+        self.clock = SystemClock() if clock is None else clock
         self.last_execution = datetime.fromtimestamp(0)
         super().__init__("cron", device_registry, invoker_manager)
 
@@ -42,18 +48,25 @@ class CronProcessor(Processor):
         except Exception as e:
             return False
 
+    def on_tick(self):
+        # at most once per clock minute
+        minute = self.clock.now().replace(second=0, microsecond=0)
+        if minute > self.last_execution:
+            self.last_execution = minute
+            for rule in list(self.rules):
+                if pycron.is_now(rule.cron, minute):
+                    self.invoke_rule(rule)
+
     def __process(self):
         while self.is_running:
             try:
-                if (datetime.now() - self.last_execution).total_seconds() >= 60:  # minimum 60 sec!
-                    self.last_execution = datetime.now()
-                    for rule in list(self.rules):
-                        if pycron.is_now(rule.cron):
-                            self.invoke_rule(rule)
+                self.on_tick()
             except Exception as e:
                 logging.warning("Error occurred by executing cron", e)
-            sleep(5)
+            self.clock.sleep(5)
 
     def on_start(self):
-        self.thread.start()
+        # a virtual clock is driven by calling on_tick() explicitly
+        if not self.clock.is_virtual:
+            self.thread.start()
 
@@ -1,4 +1,6 @@
 import tornado.ioloop
+from threading import Lock
+from typing import Any
 from webthing import (SingleThing, Property, Thing, Value, WebThingServer)
 from device import Store, DeviceManager
 
@@ -11,6 +13,9 @@ class StoreThing(Thing):
     # regarding capabilities refer https://iot.mozilla.org/schemas
     # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
 
+    # changes are pushed at most once per interval and key
+    PUSH_INTERVAL_SEC = 0.5
+
     def __init__(self, description: str, store: Store):
         Thing.__init__(
             self,
@@ -21,37 +26,58 @@ class StoreThing(Thing):
         )
         self.ioloop = tornado.ioloop.IOLoop.current()
         self.store = store
-        self.store.set_listener(self.on_value_changed)
-
         self.__props = {}
+        self.__lock = Lock()
+        self.__changed_names = set()
+        self.__is_push_scheduled = False
 
         for name in self.store.property_names:
-            val = store.get_property(name)
-            prop = Value(val, lambda value: self.store.set_property(name, value))
-            dt = "sting"
-            if type(val) == bool:
-                dt = "boolean"
-            elif type(val) == float:
-                dt = "number"
-            self.add_property(Property(self,
-                                       name,
-                                       prop,
-                                       metadata={
-                                           'title': name,
-                                           "type": dt,
-                                           'readOnly': False,
-                                       }))
-            self.__props[name] = prop
+            self.__add_property(name, store.get_property(name))
+        self.store.set_listener(self.on_value_changed)
+
+    def __add_property(self, name: str, val: Any) -> Property:
+        prop = Value(val, lambda value: self.store.set_property(name, value))
+        dt = "string"
+        if type(val) == bool:
+            dt = "boolean"
+        elif type(val) == float:
+            dt = "number"
+        property = Property(self,
+                            name,
+                            prop,
+                            metadata={
+                                'title': name,
+                                "type": dt,
+                                'readOnly': False,
+                            })
+        self.add_property(property)
+        self.__props[name] = prop
+        return property
 
     def on_value_changed(self, name: str):
-        self.ioloop.add_callback(lambda: self._on_value_changed(name))
+        # called by the rule threads. Changes are collected and pushed in batches by the ioloop
+        with self.__lock:
+            self.__changed_names.add(name)
+            if self.__is_push_scheduled:
+                return
+            self.__is_push_scheduled = True
+        self.ioloop.add_callback(self.ioloop.call_later, self.PUSH_INTERVAL_SEC, self._on_values_changed)
 
-    def _on_value_changed(self, name):
-        val = self.__props.get(name, None)
-        if val is not None:
-            val.notify_of_external_update(self.store.get_property(name))
+    def _on_values_changed(self):
+        with self.__lock:
+            changed_names = self.__changed_names
+            self.__changed_names = set()
+            self.__is_push_scheduled = False
+        for name in changed_names:
+            val = self.store.get_property(name)
+            prop = self.__props.get(name, None)
+            if prop is None:
+                # keys written the first time after startup
+                self.property_notify(self.__add_property(name, val))
+            else:
+                prop.notify_of_external_update(val)
 
 
 
 # test curl
-# curl -X PUT -d '{"time": 5.7}' http://localhost:9966/properties/time
\ No newline at end of file
+# curl -X PUT -d '{"time": 5.7}' http://localhost:9966/properties/time
@@ -1,4 +1,7 @@
 import logging
+import lazy_logging
+import inspect
+import random
 import requests
 import json
 import yaml
@@ -9,27 +12,60 @@ from redzoo.database.simple import SimpleDB
 from abc import ABC, abstractmethod
 from requests import Session
 from datetime import datetime, timedelta
-from threading import Thread
-from time import sleep
+from threading import Thread, Lock
+from time import sleep, time
 from websocket_consumer import EventConsumer, Listener
-from typing import Dict, Any, List, Optional
+from circuit_breaker import CircuitBreaker
+from tracing import tracer
+from causality import current_trace_id
+from batching import MicroBatcher
+from typing import Dict, Any, List, Optional, Tuple
 
 
+_UNKNOWN = object()
+
+
+def _accepts_old_properties(change_listener) -> bool:
+    # listeners may be change_listener(device, properties) or change_listener(device, properties, old_properties)
+    try:
+        parameters = inspect.signature(change_listener).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    if any([parameter.kind == inspect.Parameter.VAR_POSITIONAL for parameter in parameters]):
+        return True
+    return len([parameter for parameter in parameters if parameter.kind in (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)]) >= 3
 
 
 class Device(ABC):
 
+    # remote devices are connected to another shard of the rule engine
+    is_remote = False
+
     def __init__(self, name: str):
         self.name = name
         self.change_listeners = set()
+        # listeners which do not accept the old values
+        self.__two_arg_listeners = set()
         self._properties = {}
 
     def add_listener(self, change_listener):
+        if not _accepts_old_properties(change_listener):
+            self.__two_arg_listeners.add(change_listener)
         self.change_listeners.add(change_listener)
 
-    def _notify_listener(self, props: Dict[str, Any]):
-        for change_listener in self.change_listeners:
-            change_listener(self, props)
+    def _notify_listener(self, props: Dict[str, Any], old_props: Dict[str, Any] = None):
+        # old_props contains the previous values of the changed properties, if known
+        if old_props is None:
+            old_props = {}
+        for change_listener in list(self.change_listeners):
+            try:
+                if change_listener in self.__two_arg_listeners:
+                    change_listener(self, props)
+                else:
+                    change_listener(self, props, old_props)
+            except Exception as e:
+                # a failing listener must not prevent notifying the others
+                logging.warning(self.name + " error occurred notifying listener " + str(change_listener) + " " + str(e))
 
     @property
     def property_names(self) -> List[str]:
@@ -38,6 +74,18 @@ class Device(ABC):
     def get_property(self, prop_name: str, dflt = None, force_loading: bool = False) -> Any:
         return self._properties.get(prop_name, dflt)
 
+    def cached_properties(self) -> Dict[str, Any]:
+        # the local property values which can be read without loading them
+        return dict(self._properties)
+
+    def cached_property(self, prop_name: str) -> Any:
+        # the local value of a single property or None
+        return self._properties.get(prop_name, None)
+
+    def set_batch_window(self, window_ms: int):
+        # devices which do not support micro-batching of change events ignore it
+        pass
+
     def get_property_as_datetime(self, prop_name: str, dflt: datetime = None, timezone_offset: int = 0, force_loading: bool = False) -> datetime:
         dt_string = self.get_property(prop_name, dflt, force_loading)
         dt = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M")
@@ -63,6 +111,11 @@ class Device(ABC):
 
 class Webthing(Device, Listener):
 
+    # devices with a connected websocket stream are kept up-to-date by the stream. Polling is a safety net only
+    POLL_INTERVAL_STREAM_CONNECTED_SEC = 2 * 60 * 60
+    POLL_INTERVAL_STREAM_DISCONNECTED_SEC = 3 * 60
+    POLL_JITTER = 0.2
+
     def __init__(self, name: str, uri: str):
         super().__init__(name)
         if uri.endswith("/"):
@@ -71,18 +124,27 @@ class Webthing(Device, Listener):
         self.__session = Session()
         self.__is_running = False
         self.__properties_load_time = dict()
+        self.__last_time_all_loaded = datetime.fromtimestamp(0)
+        self.health = CircuitBreaker(name)
+        # optional micro-batching of the change events received by the stream
+        self.batcher: Optional[MicroBatcher] = None
         self.event_consumer = EventConsumer(name, self.uri, self).start()
 
     @staticmethod
     def create(name: str, uri: str) -> List:
+        return [Webthing(thing_name, thing_uri) for thing_name, thing_uri in Webthing.describe(name, uri)]
+
+    @staticmethod
+    def describe(name: str, uri: str) -> List[Tuple[str, str]]:
+        # a uri may refer a single thing or a gateway providing multiple things
         try:
             resp = requests.get(uri)
             resp.raise_for_status()
             data = resp.json()
             if type(data) is list:
-                return [Webthing(config['title'], config['base']) for config in data]
+                return [(config['title'], config['base']) for config in data]
             else:
-                return [Webthing(name, uri)]
+                return [(name, uri)]
         except Exception as e:
             logging.warning(name + " error occurred calling " + uri + " " + str(e))
             return []
@@ -98,18 +160,44 @@ class Webthing(Device, Listener):
             Thread(target=self.__load_all_properties_loop, daemon=True).start()
             logging.info("device " + self.name + " started")
 
+    def on_stream_opened(self):
+        logging.info(self.name + " stream opened. Resyncing properties")
+        # a reconnected device is probed, even though the circuit breaker is open
+        self.__load_all_properties(probe=True)
+
+    def set_batch_window(self, window_ms: int):
+        if window_ms <= 0:
+            self.batcher = None
+        elif self.batcher is None or self.batcher.window_sec != window_ms / 1000:
+            logging.info(self.name + " batching change events within " + str(window_ms) + " ms")
+            self.batcher = MicroBatcher(self.name, window_ms / 1000, self._notify_listener)
+
     def close(self):
         self.__is_running = False
         logging.info("disconnecting device " + self.name + " (" + self.uri + ")")
         self.event_consumer.stop()
 
     def on_property_changed(self, properties: Dict[str, Any]):
-        props_changed = {}
+        # hot path. The changed properties are collected only if there are any
+        props_changed = None
+        props_old = None
+        cached_properties = self._properties
         for name, value in properties.items():
-            if name not in self._properties.keys() or value != self._properties[name]:
+            old_value = cached_properties.get(name, _UNKNOWN)
+            if old_value != value:
+                if props_changed is None:
+                    props_changed = {}
+                    props_old = {}
                 props_changed[name] = value
-            self._properties[name] = value
-        self._notify_listener(props_changed)
+                if old_value is not _UNKNOWN:
+                    props_old[name] = old_value
+                cached_properties[name] = value
+        if props_changed is not None:
+            batcher = self.batcher
+            if batcher is None:
+                self._notify_listener(props_changed, props_old)
+            else:
+                batcher.add(props_changed, props_old)
 
     def get_property(self, prop_name: str, dlt = None, force_loading: bool = False):
         value = super().get_property(prop_name)
@@ -118,26 +206,36 @@ class Webthing(Device, Listener):
             loading = "force loading"
         elif value is None:
             loading = "local prop value is null"
-        elif self.__property_age_sec(prop_name) > 180:
+        elif self.__is_outdated(prop_name):
             loading = "local prop age is > 180 sec"
         else:
             loading = None
 
         if loading is not None:
-            logging.debug("loading " + prop_name + ". Reason: " + loading)
-            property_uri = self.uri + "/properties/" + prop_name
-            try:
-                resp = self.__session.get(property_uri, timeout=10)
-                data = resp.json()
-                value = data[prop_name]
-                if value is None:
-                    logging.warning("calling " + property_uri + " returns " + json.dumps(data, indent=2))
-                self._properties[prop_name] = value
-                self.__properties_load_time[prop_name] = datetime.now()
-                self._notify_listener({prop_name: value})
-            except Exception as e:
-                logging.warning(self.name + " error occurred calling " + property_uri + " " + str(e))
-                self.__renew_session()
+            if not self.health.acquire():
+                # fail fast. The local value is used
+                lazy_logging.debug("%s is not available (%s). Skip loading %s", self.name, self.health, prop_name)
+            else:
+                logging.debug("loading " + prop_name + ". Reason: " + loading)
+                property_uri = self.uri + "/properties/" + prop_name
+                succeeded = False
+                try:
+                    resp = self.__session.get(property_uri, timeout=10)
+                    succeeded = True
+                    data = resp.json()
+                    value = data[prop_name]
+                    if value is None:
+                        logging.warning("calling " + property_uri + " returns " + json.dumps(data, indent=2))
+                    old_value = self._properties.get(prop_name, None)
+                    self._properties[prop_name] = value
+                    self.__properties_load_time[prop_name] = datetime.now()
+                    self._notify_listener({prop_name: value}, {prop_name: old_value})
+                except Exception as e:
+                    logging.warning(self.name + " error occurred calling " + property_uri + " " + str(e))
+                    if not succeeded:
+                        self.__renew_session()
+                finally:
+                    self.health.release(succeeded)
         if value is None:
             return dlt
         else:
@@ -147,40 +245,104 @@ class Webthing(Device, Listener):
         load_time = self.__properties_load_time.get(prop_name, datetime(year=2000, month=1, day=1))
         return int((datetime.now() - load_time).total_seconds())
 
+    def __is_outdated(self, prop_name: str) -> bool:
+        return self.__property_age_sec(prop_name) > 180 and not self.__is_streamed(prop_name)
+
+    def cached_properties(self) -> Dict[str, Any]:
+        properties = dict(self._properties)
+        return {name: value for name, value in properties.items() if value is not None and not self.__is_outdated(name)}
+
+    def cached_property(self, prop_name: str) -> Any:
+        value = self._properties.get(prop_name, None)
+        if value is None or self.__is_outdated(prop_name):
+            return None
+        return value
+
+    def __is_streamed(self, prop_name: str) -> bool:
+        # the value has been loaded after the stream has been opened, i.e. each change since then has been received
+        connected_since = self.event_consumer.connected_since
+        load_time = self.__properties_load_time.get(prop_name, None)
+        return connected_since is not None and load_time is not None and load_time >= connected_since
+
     def set_property(self, prop_name: str, value: Any, reason: str = None):
         if self.get_property(prop_name, force_loading=True) != value:
+            if not self.health.acquire():
+                logging.warning(self.name + " is not available (" + str(self.health) + "). " + prop_name + " is not updated with " + str(value))
+                return
             property_uri = self.uri + "/properties/" + prop_name
+            trace_id = current_trace_id()
+            succeeded = False
             try:
                 data = json.dumps({prop_name: value})
+                started = time()
                 resp = self.__session.put(property_uri, data=data, timeout=10)
+                if trace_id is not None:
+                    tracer.span("set_property", "device", started, trace_id, device=self.name, property=prop_name, status=resp.status_code)
+                succeeded = True
+                old_value = self._properties.get(prop_name, None)
                 if resp.status_code == 200:
                     self._properties[prop_name] = value
+                    self.__properties_load_time[prop_name] = datetime.now()
                     logging.info(self.name + " (" + self.uri + ") updated: " + prop_name + "=" + str(value) + ("" if reason is None else " (" + reason + ")"))
                 else:
                     logging.info(self.name + " calling " + self.uri + " to update " + prop_name + " with " + str(value) + " failed. Got " + str(resp.status_code) + " " + resp.text)
-                self._notify_listener({prop_name: value})
+                self._notify_listener({prop_name: value}, {prop_name: old_value})
             except Exception as e:
                 logging.warning(self.name + " error occurred calling " + property_uri + " " + str(e))
-                self.__renew_session()
-
-    def __load_all_properties(self):
+                if not succeeded:
+                    self.__renew_session()
+            finally:
+                self.health.release(succeeded)
+
+    def __load_all_properties(self, probe: bool = False):
+        # each attempt resets the poll timer, i.e. a failing device is not polled on every tick
+        self.__last_time_all_loaded = datetime.now()
+        if not self.health.acquire(probe):
+            return
         property_uri = self.uri + "/properties"
+        responded = False
+        succeeded = False
         try:
+            load_time = datetime.now()
             resp = self.__session.get(property_uri, timeout=10)
+            responded = True
             if resp.status_code == 200:
                 props = resp.json()
+                props_changed = {name: value for name, value in props.items() if self._properties.get(name, _UNKNOWN) != value}
+                old_props = {name: self._properties[name] for name in props_changed.keys() if name in self._properties}
                 self._properties.update(props)
-                self._notify_listener(props)
+                for prop_name in props.keys():
+                    self.__properties_load_time[prop_name] = load_time
+                succeeded = True
+                if len(props_changed) > 0:
+                    self._notify_listener(props_changed, old_props)
             else:
                 logging.warning(self.name + " got error response calling " + property_uri + " " + str(resp.status_code) + " " + resp.text)
         except Exception as e:
             logging.warning(self.name + " error occurred calling " + property_uri + " " + str(e))
-            self.__renew_session()
+            if not responded:
+                self.__renew_session()
+        finally:
+            self.health.release(succeeded, probe)
+
+    def __poll_interval_sec(self) -> int:
+        if self.event_consumer.is_connected:
+            return self.POLL_INTERVAL_STREAM_CONNECTED_SEC
+        else:
+            return self.POLL_INTERVAL_STREAM_DISCONNECTED_SEC
 
     def __load_all_properties_loop(self):
+        # spread polling over time to avoid synchronized bursts across all devices
+        jitter = random.uniform(1 - self.POLL_JITTER, 1 + self.POLL_JITTER)
         while self.__is_running:
-            self.__load_all_properties()
-            sleep(13 * 60)
+            sleep(5)
+            if self.health.probe_due():
+                logging.info(self.name + " probing (" + str(self.health) + ")")
+                self.__load_all_properties(probe=True)
+            # a resync caused by (re)opening the stream also resets the poll timer
+            elif (datetime.now() - self.__last_time_all_loaded).total_seconds() >= self.__poll_interval_sec() * jitter:
+                self.__load_all_properties()
+                jitter = random.uniform(1 - self.POLL_JITTER, 1 + self.POLL_JITTER)
 
     def __renew_session(self):
         logging.info(self.name + " renew session")
@@ -206,7 +368,7 @@ class Store(Device):
 
     def __init__(self, directory: str, name: str = "rule_db"):
         super().__init__(self.NAME)
-        self.__listener =  lambda: None
+        self.__listener = lambda name: None
         self.__db = SimpleDB(name, directory=directory)
 
     def set_listener(self, listener):
@@ -249,19 +411,32 @@ class DeviceRegistry(ABC):
 class DeviceManager(DeviceRegistry, FileSystemEventHandler):
 
     FILENAME = "webthings.yml"
+    MIN_RESOLVE_INTERVAL_SEC = 30
+    MAX_RESOLVE_INTERVAL_SEC = 30 * 60
 
     def __init__(self, dir: str):
         self.__is_running = True
         self.dir =  dir
         self.__change_listeners = set()
-        self.__db_device = Store(join(dir, 'data'))
+        self.__db_device = self._create_store()
         self.__device_map = { self.__db_device.name: self.__db_device }
         self.observer = Observer()
         self.__last_time_reloaded = datetime.now() - timedelta(days=300)
+        self.__reload_lock = Lock()
+        self.__resolve_lock = Lock()
+        # negative cache. device name -> (next time to resolve, current backoff)
+        self.__missing_devices: Dict[str, Tuple[datetime, int]] = {}
+        self.__is_resolving = False
 
     def add_change_listener(self, change_listener):
         self.__change_listeners.add(change_listener)
 
+    def _create_store(self) -> Device:
+        return Store(join(self.dir, 'data'))
+
+    def _create_device(self, name: str, uri: str) -> Device:
+        return Webthing(name, uri)
+
     def start(self):
         self.observer.schedule(self, self.dir, recursive=False)
         self.observer.start()
@@ -280,18 +455,36 @@ class DeviceManager(DeviceRegistry, FileSystemEventHandler):
     def device(self, name: str) -> Optional[Device]:
         device = self.__device_map.get(name, None)
         if device is None:
-            elapsed_sec = (datetime.now() - self.__last_time_reloaded).total_seconds()
-            max_frequency = 30
-            if elapsed_sec > max_frequency:
-                logging.warning("device " + name + " not available. Reloading config")
-                self.__reload_config()
-                device = self.__device_map.get(name, None)
-            else:
-                logging.warning("device " + name + " not available. Suppress reloading config (was tried " + str(int(elapsed_sec)) + " sec ago; min wait time: " + str(max_frequency) + " sec)")
-        if device is None:
-            logging.warning("device " + name + " not available. Returning None (available devices: " + ", " .join([device.name for device in self.devices]) + ")")
+            self.__on_missing_device(name)
         return device
 
+    def __on_missing_device(self, name: str):
+        # called on the rule threads. Must not block
+        now = datetime.now()
+        missing = self.__missing_devices.get(name, None)
+        if missing is None:
+            logging.warning("device " + name + " not available. Returning None (available devices: " + ", " .join([device.name for device in self.devices]) + ")")
+            self.__missing_devices[name] = (now + timedelta(seconds=self.MIN_RESOLVE_INTERVAL_SEC), self.MIN_RESOLVE_INTERVAL_SEC)
+            self.__resolve_async()
+        elif now >= missing[0]:
+            backoff = min(missing[1] * 2, self.MAX_RESOLVE_INTERVAL_SEC)
+            logging.info("device " + name + " still not available. Next retry in " + str(backoff) + " sec")
+            self.__missing_devices[name] = (now + timedelta(seconds=backoff), backoff)
+            self.__resolve_async()
+
+    def __resolve_async(self):
+        with self.__resolve_lock:
+            if self.__is_resolving or (datetime.now() - self.__last_time_reloaded).total_seconds() < self.MIN_RESOLVE_INTERVAL_SEC:
+                return
+            self.__is_resolving = True
+        Thread(target=self.__resolve, daemon=True).start()
+
+    def __resolve(self):
+        try:
+            self.__reload_config()
+        finally:
+            self.__is_resolving = False
+
     def dispatch(self, event: FileSystemEvent) -> None:
         super().dispatch(event)
 
@@ -319,19 +512,25 @@ class DeviceManager(DeviceRegistry, FileSystemEventHandler):
 
     def __reload_config(self):
         if self.__is_running:
-            self.__last_time_reloaded = datetime.now()
-            try:
-                webthing_file = join(self.dir, self.FILENAME)
-                logging.info("reading " + webthing_file)
-                with open(webthing_file) as file:
-                    for device_name, config in yaml.safe_load(file).items():
-                        for device in Webthing.create(device_name, config['url']):
-                            if device.name not in self.__device_map.keys():
-                                device.start()
-                                self.__device_map[device.name] = device
-                logging.info("devices available: " + ", ".join(sorted([device.name for device in self.devices])))
-            except Exception as e:
-                logging.warning("error occurred refreshing config " + str(e))
+            with self.__reload_lock:
+                self.__last_time_reloaded = datetime.now()
+                try:
+                    webthing_file = join(self.dir, self.FILENAME)
+                    logging.info("reading " + webthing_file)
+                    with open(webthing_file) as file:
+                        for device_name, config in yaml.safe_load(file).items():
+                            for thing_name, thing_uri in Webthing.describe(device_name, config['url']):
+                                # creating a webthing connects its stream. Known devices are not created again
+                                if thing_name not in self.__device_map.keys():
+                                    device = self._create_device(thing_name, thing_uri)
+                                    device.start()
+                                    self.__device_map[thing_name] = device
+                                # optional, e.g. batch_window_ms: 200
+                                self.__device_map[thing_name].set_batch_window(int(config.get('batch_window_ms', 0)))
+                    logging.info("devices available: " + ", ".join(sorted([device.name for device in self.devices])))
+                except Exception as e:
+                    logging.warning("error occurred refreshing config " + str(e))
+                self.__missing_devices = {name: missing for name, missing in self.__missing_devices.items() if name not in self.__device_map.keys()}
             self.__notify_listeners()
         else:
             [device.close() for device in self.__device_map.values()]
@@ -0,0 +1,36 @@
+from typing import Any, Dict, List, Tuple
+
+
+
+class DispatchPlan:
+    """
+    The annotations of a module, parsed once and routed by trigger type (the first word of the
+    trigger expression such as 'property' or 'time') to the processors
+    """
+
+    def __init__(self, module: str, routes: Dict[str, Dict[Any, List[str]]]):
+        self.module = module
+        self.routes = routes
+
+    @staticmethod
+    def trigger_type(annotation: str) -> str:
+        words = annotation.strip().split(maxsplit=1)
+        return words[0].lower() if len(words) > 0 else ""
+
+    @staticmethod
+    def compile(module: str, function_annotations: Dict[Any, List[str]]):
+        routes: Dict[str, Dict[Any, List[str]]] = {}
+        for func, annotations in function_annotations.items():
+            for annotation in annotations:
+                routes.setdefault(DispatchPlan.trigger_type(annotation), {}).setdefault(func, []).append(annotation)
+        return DispatchPlan(module, routes)
+
+    def annotations_of(self, trigger_type: str) -> Dict[Any, List[str]]:
+        return self.routes.get(trigger_type, {})
+
+    def unrouted(self, trigger_types: List[str]) -> List[Tuple[Any, str]]:
+        return [(func, annotation) for trigger_type, function_annotations in self.routes.items() if trigger_type not in trigger_types
+                for func, annotations in function_annotations.items() for annotation in annotations]
+
+    def __len__(self):
+        return sum([len(annotations) for function_annotations in self.routes.values() for annotations in function_annotations.values()])
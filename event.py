@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import Any, Dict, List
+
+
+class PropertyChangedEvent:
+    """
+    A single property change. A rule receives it, if it declares a parameter of this type, e.g.
+    on_pv(event: PropertyChangedEvent) or on_pv(registry: DeviceRegistry, event: PropertyChangedEvent)
+    """
+
+    __slots__ = ('device', 'property', 'new_value', 'old_value', 'timestamp', 'initiator')
+
+    def __init__(self, device: str, property: str, new_value: Any, old_value: Any, timestamp: datetime, initiator: str):
+        self.device = device
+        self.property = property
+        self.new_value = new_value
+        self.old_value = old_value
+        self.timestamp = timestamp
+        self.initiator = initiator
+
+    def __str__(self):
+        return self.device + "#" + self.property + ": " + str(self.old_value) + " -> " + str(self.new_value) + " (" + self.initiator + ")"
+
+
+class PropertyChangesEvent:
+    """
+    All property changes of a device reported at once (e.g. by a single websocket message). A rule receives it,
+    if it declares a parameter of this type
+    """
+
+    __slots__ = ('device', 'changes', 'timestamp', 'initiator')
+
+    def __init__(self, device: str, changes: List[PropertyChangedEvent], timestamp: datetime, initiator: str):
+        self.device = device
+        self.changes = changes
+        self.timestamp = timestamp
+        self.initiator = initiator
+
+    @staticmethod
+    def create(device: str, properties: Dict[str, Any], old_properties: Dict[str, Any], initiator: str):
+        timestamp = datetime.now()
+        return PropertyChangesEvent(device,
+                                    [PropertyChangedEvent(device, name, value, old_properties.get(name, None), timestamp, initiator) for name, value in properties.items()],
+                                    timestamp,
+                                    initiator)
+
+    def change(self, property: str):
+        for change in self.changes:
+            if change.property == property:
+                return change
+        return None
+
+    @property
+    def new_values(self) -> Dict[str, Any]:
+        return {change.property: change.new_value for change in self.changes}
+
+    def __str__(self):
+        return ", ".join([str(change) for change in self.changes])
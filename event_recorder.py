@@ -0,0 +1,97 @@
+import os
+import json
+import logging
+import struct
+from os.path import join, exists
+from time import time, sleep
+from typing import Callable, Iterator, List, Optional, Tuple
+from websocket_consumer import Listener
+from rotating_file import RotatingFile
+
+
+
+# record: timestamp, length of device name, length of message, device name, message
+HEADER = struct.Struct("<dHI")
+
+
+class EventRecorder:
+
+    FILENAME = "events.rec"
+
+    def __init__(self, directory: str, max_file_size: int = 64 * 1024 * 1024, max_files: int = 10):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        os.makedirs(directory, exist_ok=True)
+        self.__file = RotatingFile(join(directory, self.FILENAME), max_file_size, max_files)
+
+    def record(self, device_name: str, message):
+        name = device_name.encode("utf-8")
+        payload = message.encode("utf-8") if isinstance(message, str) else message
+        self.__file.write(HEADER.pack(time(), len(name), len(payload)) + name + payload)
+
+    def flush(self):
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class EventReplayer:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def files(self) -> List[str]:
+        filename = join(self.directory, EventRecorder.FILENAME)
+        rotated = []
+        i = 1
+        while exists(filename + "." + str(i)):
+            rotated.append(filename + "." + str(i))
+            i += 1
+        files = list(reversed(rotated))   # oldest first
+        if exists(filename):
+            files.append(filename)
+        return files
+
+    def events(self) -> Iterator[Tuple[float, str, bytes]]:
+        for filename in self.files():
+            with open(filename, "rb") as file:
+                while True:
+                    header = file.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    timestamp, name_len, payload_len = HEADER.unpack(header)
+                    name = file.read(name_len)
+                    payload = file.read(payload_len)
+                    if len(payload) < payload_len:
+                        logging.warning(filename + " is truncated. Ignoring last record")
+                        break
+                    yield timestamp, name.decode("utf-8"), payload
+
+    def replay(self, listener_of: Callable[[str], Optional[Listener]], speed: Optional[float] = 1.0) -> int:
+        """
+        Args:
+            listener_of: returns the listener, typically the Webthing, of a device name
+            speed: 1.0 replays with original speed, 10.0 ten times faster. None replays as fast as possible
+        Returns:
+            the number of replayed property change messages
+        """
+        num_replayed = 0
+        first_recorded = None
+        started = time()
+        for timestamp, device_name, message in self.events():
+            if speed is not None:
+                if first_recorded is None:
+                    first_recorded = timestamp
+                delay = (timestamp - first_recorded) / speed - (time() - started)
+                if delay > 0:
+                    sleep(delay)
+            listener = listener_of(device_name)
+            if listener is None:
+                continue
+            data = json.loads(message)
+            if data.get('messageType', None) == 'propertyStatus':
+                listener.on_property_changed(data['data'])
+                num_replayed += 1
+        return num_replayed
@@ -0,0 +1,90 @@
+import logging
+from threading import Lock
+from typing import Dict, Any, Set, Tuple
+from rule import Rule
+from invoke import InvokerManager
+from processor import Processor
+from device import DeviceRegistry, Device
+from event import PropertyChangedEvent, PropertyChangesEvent
+from causality import current_trace
+
+
+
+class InputsChangedRule(Rule):
+
+    __slots__ = ('inputs', '__inputs_listener')
+
+    def __init__(self, trigger_expression: str, func, invoker_manager: InvokerManager, inputs_listener):
+        self.inputs: Set[Tuple[str, str]] = set()
+        self.__inputs_listener = inputs_listener
+        super().__init__(trigger_expression, func, invoker_manager)
+
+    def on_executed(self, device_registry: DeviceRegistry):
+        # the device registry passed to the rule records the properties read by the rule
+        inputs = getattr(device_registry, 'read_properties', None)
+        if inputs is not None and inputs != self.inputs:
+            self.inputs = inputs
+            self.__inputs_listener(self)
+
+
+class InputsChangedProcessor(Processor):
+
+    TRIGGER_TYPE = "inputs"
+
+    def __init__(self, device_registry: DeviceRegistry, invoker_manager: InvokerManager):
+        super().__init__("inputs changed", device_registry, invoker_manager)
+        self.__lock = Lock()
+        self.__registered_rules: Dict[str, InputsChangedRule] = {}
+        # copy-on-write. The subscriptions are read by the stream threads without locking
+        self.__subscriptions: Dict[Tuple[str, str], Set[InputsChangedRule]] = {}
+
+    def on_annotation(self, annotation: str, func) -> bool:
+        if annotation.lower().strip() == "inputs changed":
+            rule = InputsChangedRule(annotation, func, self._invoker_manager, self.__on_inputs_changed)
+            if rule.event_type is PropertyChangedEvent:
+                # the inputs may change at once
+                logging.warning(rule.module + ".py#" + rule.function_name + "(...) is ignored. @when(\"" + annotation + "\") rules receive a PropertyChangesEvent, not a PropertyChangedEvent")
+                return True
+            self.add_rule(rule)
+            return True
+        return False
+
+    def on_add_rule(self, rule: Rule):
+        with self.__lock:
+            self.__registered_rules[rule.fingerprint()] = rule
+        # the inputs are unknown before the rule has been executed the first time
+        self.invoke_rule(rule)
+
+    def on_remove_rules(self, module: str):
+        with self.__lock:
+            self.__registered_rules = {fingerprint: rule for fingerprint, rule in self.__registered_rules.items() if rule.module != module}
+            self.__update_subscriptions(lambda rule: rule.module != module)
+
+    def __update_subscriptions(self, keep, rule: InputsChangedRule = None):
+        subscriptions = {key: {subscribed_rule for subscribed_rule in rules if keep(subscribed_rule)} for key, rules in self.__subscriptions.items()}
+        if rule is not None:
+            for key in rule.inputs:
+                subscriptions[key] = subscriptions.get(key, set()) | {rule}
+        self.__subscriptions = {key: rules for key, rules in subscriptions.items() if len(rules) > 0}
+
+    def __on_inputs_changed(self, rule: InputsChangedRule):
+        with self.__lock:
+            if self.__registered_rules.get(rule.fingerprint(), None) is not rule:
+                return   # rule has been unregistered in the meantime
+            self.__update_subscriptions(lambda subscribed_rule: subscribed_rule != rule, rule)
+        logging.debug(rule.module + ".py#" + rule.function_name + "(...) inputs: " + ", ".join(sorted([device + "#" + prop for device, prop in rule.inputs])))
+        for device_name in {device_name for device_name, _ in rule.inputs}:
+            device = self._device_registry.device(device_name)
+            if device is not None:
+                device.add_listener(self.__on_property_changed)
+
+    def __on_property_changed(self, device: Device, properties: Dict[str, Any], old_properties: Dict[str, Any]):
+        subscriptions = self.__subscriptions
+        rules = set()
+        for name in properties.keys():
+            rules.update(subscriptions.get((device.name, name), ()))
+        if len(rules) > 0:
+            trace = current_trace()
+            event = PropertyChangesEvent.create(device.name, properties, old_properties, device.name if trace is None else trace.chain[-1])
+            for rule in rules:
+                self.invoke_rule(rule, event)
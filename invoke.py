@@ -1,66 +1,134 @@
 import inspect
 import logging
+import lazy_logging
+import profiling
+from time import perf_counter, time
 from abc import ABC, abstractmethod
-from typing import Optional, List
-from queue import Queue, Empty
+from typing import Dict, Optional, List
+from queue import Empty
 from datetime import datetime
-from threading import Thread, Lock
+from threading import Thread
 from device import DeviceRegistry
+from event import PropertyChangedEvent, PropertyChangesEvent
+from snapshot import DeviceRegistrySnapshot
+from causality import CausalTrace, CascadeMonitor, current_trace, set_current_trace, current_trace_id, set_current_trace_id
+from lazy_logging import trace_sampler
+from notifier import CoalescingNotifier
+from tracing import tracer
+from scheduling import FairQueue, ModulePolicy
 
 
 
 class Invoker(ABC):
 
+    __slots__ = ()
+
     @abstractmethod
-    def invoke(self, device_registry: DeviceRegistry, initiator: str):
+    def invoke(self, device_registry: DeviceRegistry, initiator: str, listener = None, event = None):
         pass
 
+    @property
+    def event_type(self) -> Optional[type]:
+        # the event type expected by the function, if any
+        return None
+
 
 
 class InvokerImpl(Invoker):
 
-    TYPE_SINGLE_PARAM_ITEMREGISTRY = "TYPE_SINGLE_PARAM_ITEMREGISTRY"
+    # invokers are used as keys of the running invocations. The (default) identity hash is the cheapest one
+    __slots__ = ('_func', 'name', 'module', 'fullname', '__params', '__event_type')
+
+    PARAM_TYPES = [DeviceRegistry, PropertyChangedEvent, PropertyChangesEvent]
 
     @staticmethod
     def create(func) -> Optional:
-        type = ""
         spec = inspect.getfullargspec(func)
 
-        # one argument ItemRegistry
-        if len(spec.args) == 1:
-            type = InvokerImpl.TYPE_SINGLE_PARAM_ITEMREGISTRY
-            if spec.args[0] in spec.annotations:
-                if spec.annotations[spec.args[0]] != DeviceRegistry:
-                    logging.warning("parameter " + str(spec.args[0]) + " is of type " + str(spec.annotations[spec.args[0]]) + ". " +
-                                    str(spec.annotations[spec.args[0]]) + " is not supported (supported: DeviceRegistry)")
+        params = []
+        for arg in spec.args:
+            if arg in spec.annotations:
+                annotation = spec.annotations[arg]
+                param_type = None
+                for supported_type in InvokerImpl.PARAM_TYPES:
+                    # annotations may be strings, e.g. if postponed evaluation of annotations is enabled
+                    if annotation == supported_type or annotation == supported_type.__name__:
+                        param_type = supported_type
+                if param_type is None:
+                    logging.warning("parameter " + str(arg) + " is of type " + str(annotation) + ". " + str(annotation) +
+                                    " is not supported (supported: " + ", ".join([supported_type.__name__ for supported_type in InvokerImpl.PARAM_TYPES]) + ")")
                     return None
+                params.append(param_type)
+            elif len(spec.args) == 1:
+                logging.warning("assuming that parameter " + arg + " is of type DeviceRegistry. " \
+                                                                  "Please use type hints such as " + func.__name__ + "(" + arg  + ": DeviceRegistry)")
+                params.append(DeviceRegistry)
             else:
-                logging.warning("assuming that parameter " + spec.args[0] + " is of type DeviceRegistry. " \
-                                                                            "Please use type hints such as " + func.__name__ + "(" + spec.args[0]  + ": DeviceRegistry)")
-        return InvokerImpl(func, type)
+                logging.warning("parameter " + str(arg) + " of " + func.__name__ + " has no type hint. Please use type hints such as " +
+                                func.__name__ + "(registry: DeviceRegistry, event: PropertyChangedEvent)")
+                return None
+        return InvokerImpl(func, params)
 
-    def __init__(self, func, type: str):
+    def __init__(self, func, params: List[type]):
         self._func = func
         self.name = func.__name__
-        self.fullname = func.__module__ + "#" + self.name
-        self.__type = type
+        self.module = func.__module__
+        self.fullname = self.module + "#" + self.name
+        self.__params = tuple(params)
+        self.__event_type = None
+        for param_type in params:
+            if param_type is not DeviceRegistry:
+                self.__event_type = param_type
+
+    @property
+    def event_type(self) -> Optional[type]:
+        return self.__event_type
 
     def __str__(self):
         return self.fullname
 
-    def invoke(self, device_registry: DeviceRegistry, initiator: str):
+    def invoke(self, device_registry: DeviceRegistry, initiator: str, listener = None, event = None):
+        trace_id = current_trace_id()
+        started = 0 if trace_id is None else time()
         try:
-            logging.debug("calling " + str(self._func.__name__) + " (initiator: " + initiator + ")")
-            if self.__type == self.TYPE_SINGLE_PARAM_ITEMREGISTRY:
-                self._func(device_registry)
+            lazy_logging.debug("calling %s (initiator: %s)", self.name, initiator)
+            profiler = profiling.active
+            if profiler is not None and profiler.matches(self.fullname):
+                profiler.run(self.__call, device_registry, event)
             else:
-                self._func()
+                self.__call(device_registry, event)
+            if trace_id is not None:
+                tracer.span("invoke", "rule", started, trace_id, rule=self.fullname, initiator=initiator)
         except Exception as e:
+            if trace_id is not None:
+                tracer.span("invoke", "rule", started, trace_id, rule=self.fullname, initiator=initiator, error=str(e))
             raise Exception("Error occurred executing function " + self.fullname + "(...)" + " " + str(e)) from e
+        if listener is not None:
+            listener(device_registry)
+
+    def __call(self, device_registry: DeviceRegistry, event):
+        if len(self.__params) == 0:
+            self._func()
+        else:
+            self._func(*[self.__arg(param_type, device_registry, event) for param_type in self.__params])
+
+    @staticmethod
+    def __arg(param_type: type, device_registry: DeviceRegistry, event):
+        if param_type is DeviceRegistry:
+            return device_registry
+        elif event is None or isinstance(event, param_type):
+            # rules which are not triggered by a property change (e.g. cron rules) get no event
+            return event
+        elif param_type is PropertyChangesEvent:
+            return PropertyChangesEvent(event.device, [event], event.timestamp, event.initiator)
+        else:
+            raise Exception("got " + str(len(event.changes)) + " changes, but a single PropertyChangedEvent is expected")
 
 
 class AsyncInvokerWrapper(Invoker):
 
+    __slots__ = ('invoker', 'invoker_manager')
+
     @staticmethod
     def create(invoker: Invoker, invoker_manager) -> Optional:
         if invoker is None:
@@ -72,102 +140,154 @@ class AsyncInvokerWrapper(Invoker):
         self.invoker = invoker
         self.invoker_manager = invoker_manager
 
-    def invoke(self, device_registry: DeviceRegistry, initiator: str):
-        self.invoker_manager.invoke_async(Invocation(self.invoker, device_registry, initiator))
+    @property
+    def event_type(self) -> Optional[type]:
+        return self.invoker.event_type
+
+    def invoke(self, device_registry: DeviceRegistry, initiator: str, listener = None, event = None):
+        # invocations caused by property writes of a running rule are part of its cascade
+        parent = current_trace()
+        if parent is None:
+            trace = CausalTrace(initiator, (str(self.invoker),))
+        else:
+            trace = parent.child(str(self.invoker))
+        if self.invoker_manager.cascade_monitor.admit(trace):
+            self.invoker_manager.invoke_async(Invocation(self.invoker, device_registry, initiator, listener, trace, event, current_trace_id()))
 
 
 class Invocation:
 
-    def __init__(self, invoker: Invoker, device_registry : DeviceRegistry, initiator: str):
+    __slots__ = ('invoker', 'initiator', 'device_registry', 'listener', 'trace', 'event', 'trace_id', 'enqueued')
+
+    def __init__(self, invoker: Invoker, device_registry : DeviceRegistry, initiator: str, listener = None, trace: CausalTrace = None, event = None, trace_id: str = None):
         self.invoker = invoker
         self.initiator = initiator
         self.device_registry = device_registry
+        self.listener = listener
+        self.trace = trace
+        self.event = event
+        # id of the latency trace, if the causing event is sampled
+        self.trace_id = trace_id
+        self.enqueued = 0 if trace_id is None else time()
 
     def invoke(self):
-        self.invoker.invoke(self.device_registry, self.initiator)
+        parent_trace = current_trace()
+        parent_trace_id = current_trace_id()
+        set_current_trace(self.trace)
+        if self.trace_id is not None:
+            tracer.span("queued", "invoker", self.enqueued, self.trace_id, rule=str(self.invoker))
+        set_current_trace_id(self.trace_id)
+        try:
+            # each invocation gets its own consistent view on the devices
+            self.invoker.invoke(DeviceRegistrySnapshot(self.device_registry), self.initiator, self.listener, self.event)
+        finally:
+            set_current_trace(parent_trace)
+            set_current_trace_id(parent_trace_id)
+
+    @property
+    def module(self) -> str:
+        # invocations are scheduled per rule module
+        return getattr(self.invoker, 'module', "")
 
     def __str__(self):
         return str(self.invoker)
 
 class InvokerManager:
 
-    def __init__(self, num_runners: int = 10):
+    def __init__(self, num_runners: int = 10, policies: Dict[str, ModulePolicy] = None):
         self.is_running = True
         self.num_runners = num_runners
-        self.__listeners = set()
-        self.__lock = Lock()
+        # the running invocations are updated lock-free by the runners (single dict operations are atomic)
         self.__running_invocations = {}
-        self.__queue = Queue()
+        self.__notifier = CoalescingNotifier("invoker manager")
+        self.__queue = FairQueue(policies)
+        self.cascade_monitor = CascadeMonitor()
+
+    def set_policies(self, policies: Dict[str, ModulePolicy]):
+        # has to be called before starting
+        self.__queue = FairQueue(policies)
+
+    def queue_statistics(self) -> List[str]:
+        # queue depth, running invocations and wait times per rule module
+        return self.__queue.statistics()
 
     def running_invocations(self) -> List[str]:
-        with self.__lock:
-            info = []
-            for invoker, running_since in self.__running_invocations.items():
-                info.append(str(invoker) + " (since " + str((datetime.now() - running_since)) + ")")
-            return sorted(info)
+        info = []
+        for invoker, running_since in list(self.__running_invocations.items()):
+            info.append(str(invoker) + " (since " + str((datetime.now() - running_since)) + ")")
+        return sorted(info)
 
     def add_listener(self, listener):
-        self.__listeners.add(listener)
-        self.__notify_listener()
-
-    def __notify_listener(self):
-        for listener in self.__listeners:
-            try:
-                listener()
-            except Exception as e:
-                logging.warning("error occurred calling " + str(listener) + " " + str(e))
+        # listeners are called asynchronously. Changes of the running invocations are coalesced
+        self.__notifier.add_listener(listener)
 
     def start(self):
         [Thread(target=self.process_invoke_runner, daemon=True, args=(i,)).start() for i in range(0, self.num_runners)]
+        runner_id = self.num_runners
+        for module, policy in self.__queue.policies.items():
+            for _ in range(policy.reserved_runners):
+                Thread(target=self.process_invoke_runner, daemon=True, args=(runner_id, module)).start()
+                runner_id += 1
 
     def stop(self):
         self.is_running = False
+        self.__notifier.stop()
 
     def register_running(self, invocation_runner : Invocation) -> Optional[datetime]:
-        try:
-            with self.__lock:
-                if invocation_runner.invoker in self.__running_invocations.keys():
-                    return self.__running_invocations[invocation_runner.invoker]
-                else:
-                    self.__running_invocations[invocation_runner.invoker] = datetime.now()
-                    return None
-        finally:
-            self.__notify_listener()
+        now = datetime.now()
+        # atomic check-and-set. The invoker uses the identity hash, i.e. no python code is executed while updating the dict
+        running_since = self.__running_invocations.setdefault(invocation_runner.invoker, now)
+        if running_since is now:
+            self.__notifier.notify()
+            return None
+        else:
+            return running_since
 
     def deregister_running(self, invocation_runner : Invocation):
-        try:
-            with self.__lock:
-                self.__running_invocations.pop(invocation_runner.invoker, None)
-        finally:
-            self.__notify_listener()
+        self.__running_invocations.pop(invocation_runner.invoker, None)
+        self.__notifier.notify()
 
 
     def invoke_async(self, invocation: Invocation):
         self.__queue.put(invocation)
 
-    def process_invoke_runner(self, runner_id: int):
+    def process_invoke_runner(self, runner_id: int, module: Optional[str] = None):
+        # runners with a module are reserved for the invocations of this module
         while self.is_running:
             try:
-                invocation = self.__queue.get(timeout=3)
-                running_since = self.register_running(invocation)
-                if running_since is None:
-                    try:
-                        logging.debug("[runner" + str(runner_id) + "] invoking " + str(invocation))
-                        invocation.invoke()
-                    except Exception as e:
-                        logging.warning("[runner" + str(runner_id) + "] error occurred calling " + str(invocation) + " " + str(e), e)
-                    finally:
-                        self.deregister_running(invocation)
-                else:
-                    elapsed = datetime.now() - running_since
-                    if elapsed.total_seconds() > 2 * 60:
-                        logging.warning("[runner" + str(runner_id) + "] reject invoking " + str(invocation) + " Invocation hangs (since " + str(elapsed) + ")")
-                    else:
-                        logging.debug("[runner" + str(runner_id) + "] reject invoking " + str(invocation) + " Invocation is already running (since " + str(elapsed) + ")")
+                invocation = self.__queue.get(module, timeout=3)
+                try:
+                    self._execute(invocation, runner_id)
+                finally:
+                    self.__queue.done(invocation)
             except Empty as e:
                 pass
             except Exception as e:
-                logging.warning("[runner" + str(runner_id) + "] error occurred " + str(e))
+                lazy_logging.warning("[runner%d] error occurred %s", runner_id, e)
+
+    def _execute(self, invocation: Invocation, runner_id: int):
+        running_since = self.register_running(invocation)
+        if running_since is None:
+            try:
+                lazy_logging.debug("[runner%d] invoking %s", runner_id, invocation)
+                if trace_sampler.is_sampled():
+                    started = perf_counter()
+                    invocation.invoke()
+                    trace_sampler.trace("invocation", rule=invocation, initiator=invocation.initiator, runner=runner_id, elapsed_ms=round((perf_counter() - started) * 1000, 2))
+                else:
+                    invocation.invoke()
+            except Exception as e:
+                lazy_logging.warning("[runner%d] error occurred calling %s %s", runner_id, invocation, e)
+            finally:
+                self.deregister_running(invocation)
+                if invocation.trace is not None:
+                    self.cascade_monitor.on_completed(invocation.trace)
+        else:
+            elapsed = datetime.now() - running_since
+            if elapsed.total_seconds() > 2 * 60:
+                lazy_logging.warning("[runner%d] reject invoking %s Invocation hangs (since %s)", runner_id, invocation, elapsed)
+            else:
+                lazy_logging.debug("[runner%d] reject invoking %s Invocation is already running (since %s)", runner_id, invocation, elapsed)
 
     def new_invoker(self, func):
         invoker = InvokerImpl.create(func)
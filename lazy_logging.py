@@ -0,0 +1,61 @@
+import logging
+from itertools import count
+from typing import Any
+
+
+
+# logging facility of the hot paths (rule dispatching and invocation). Messages are formatted
+# lazily, i.e. only if the level is enabled. Call sites which log in loops should check
+# is_debug() once in front of the loop
+
+_logger = logging.getLogger()
+
+
+def is_debug() -> bool:
+    return _logger.isEnabledFor(logging.DEBUG)
+
+
+def debug(msg: str, *args):
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug(msg, *args)
+
+
+def warning(msg: str, *args):
+    _logger.warning(msg, *args)
+
+
+class _Fields:
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join([name + "=" + str(value) for name, value in self.fields.items()])
+
+
+class TraceSampler:
+    """
+    Sampled, structured trace log. Each n-th event is logged on INFO level, e.g.
+    trace invocation rule=heating#on_temp initiator=Property change runner=3 elapsed_ms=2.1
+    """
+
+    def __init__(self):
+        self.__every = 0
+        self.__counter = count()
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.__every > 0
+
+    def set_sample_rate(self, rate: float):
+        # 0 disables tracing, 1 traces each event
+        self.__every = 0 if rate <= 0 else max(1, round(1 / rate))
+
+    def is_sampled(self) -> bool:
+        return self.__every > 0 and next(self.__counter) % self.__every == 0
+
+    def trace(self, event: str, **fields: Any):
+        _logger.info("trace %s %s", event, _Fields(fields))
+
+
+trace_sampler = TraceSampler()
@@ -1,3 +1,5 @@
+from threading import Lock
+from typing import List
 from rule import Rule
 from invoke import InvokerManager
 from processor import Processor
@@ -6,8 +8,14 @@ from device import DeviceRegistry
 
 class RuleLoadedProcessor(Processor):
 
+    TRIGGER_TYPE = "rule"
+
     def __init__(self, device_registry: DeviceRegistry, invoker_manager: InvokerManager):
         super().__init__("rule loaded", device_registry, invoker_manager)
+        self.__lock = Lock()
+        self.__num_reloads = 0
+        # rules added while all modules are (re)loaded. They are invoked, if all modules are registered
+        self.__held_rules: List[Rule] = []
 
     def on_annotation(self, annotation: str, func):
         if annotation.lower().strip() == "rule loaded":
@@ -16,4 +24,25 @@ class RuleLoadedProcessor(Processor):
         return False
 
     def on_add_rule(self, rule: Rule):
+        with self.__lock:
+            if self.__num_reloads > 0:
+                self.__held_rules.append(rule)
+                return
         self.invoke_rule(rule)
+
+    def on_reload_started(self):
+        with self.__lock:
+            self.__num_reloads += 1
+
+    def on_reload_completed(self):
+        with self.__lock:
+            self.__num_reloads -= 1
+            if self.__num_reloads > 0:
+                return
+            held_rules = self.__held_rules
+            self.__held_rules = []
+        registered_rules = {id(rule) for rule in self.rules}
+        for rule in held_rules:
+            # the module may have been unloaded in the meantime
+            if id(rule) in registered_rules:
+                self.invoke_rule(rule)
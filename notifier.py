@@ -0,0 +1,44 @@
+import logging
+from time import sleep
+from threading import Thread, Lock
+
+
+
+class CoalescingNotifier:
+    """
+    Decouples change listeners from the threads which report changes. notify() only marks the state as
+    changed; the listeners are called by a separate thread, at most once per interval
+    """
+
+    def __init__(self, name: str, min_interval_sec: float = 1):
+        self.name = name
+        self.min_interval_sec = min_interval_sec
+        self.__listeners = set()
+        self.__lock = Lock()
+        self.__is_changed = False
+        self.__is_running = False
+
+    def add_listener(self, listener):
+        with self.__lock:
+            self.__listeners.add(listener)
+            if not self.__is_running:
+                self.__is_running = True
+                Thread(target=self.__process, daemon=True).start()
+        self.notify()
+
+    def notify(self):
+        self.__is_changed = True
+
+    def stop(self):
+        self.__is_running = False
+
+    def __process(self):
+        while self.__is_running:
+            sleep(self.min_interval_sec)
+            if self.__is_changed:
+                self.__is_changed = False
+                for listener in list(self.__listeners):
+                    try:
+                        listener()
+                    except Exception as e:
+                        logging.warning(self.name + " error occurred calling " + str(listener) + " " + str(e))
@@ -1,4 +1,5 @@
 import logging
+import lazy_logging
 from abc import ABC, abstractmethod
 from typing import Dict, List, Any
 from rule import Rule
@@ -8,6 +9,9 @@ from invoke import InvokerManager
 
 class Processor(ABC):
 
+    # the first word of the trigger expressions handled by the processor. See DispatchPlan
+    TRIGGER_TYPE = ""
+
     def __init__(self, name: str, device_registry: DeviceRegistry, invoker_manager: InvokerManager):
         self.name = name
         self._device_registry = device_registry
@@ -25,22 +29,23 @@ class Processor(ABC):
         pass
 
     def add_rule(self, rule: Rule):
-        logging.debug(' * register ' + rule.module + '.py#' + rule.function_name + '(...) on @when("' + rule.trigger_expression + '")')
+        lazy_logging.debug(' * register %s.py#%s(...) on @when("%s")', rule.module, rule.function_name, rule.trigger_expression)
         self.rules.add(rule)
         self.on_add_rule(rule)
 
     def remove_rules(self, module: str):
         rules_of_module = {rule for rule in self.rules if rule.module == module}
-        for rule in rules_of_module:
-            logging.debug(' * unregister ' + rule.module + '.py#' + rule.function_name + '(...) on @when("' + rule.trigger_expression + '")')
+        if lazy_logging.is_debug():
+            for rule in rules_of_module:
+                lazy_logging.debug(' * unregister %s.py#%s(...) on @when("%s")', rule.module, rule.function_name, rule.trigger_expression)
         self.rules = self.rules - rules_of_module
         self.on_remove_rules(module)
 
-    def invoke_rule(self, rule: Rule):
+    def invoke_rule(self, rule: Rule, event = None):
         try:
-            rule.invoke(self._device_registry, self.name)
+            rule.invoke(self._device_registry, self.name, event)
         except Exception as e:
-            logging.warning("Error occurred by executing rule " + rule.function_name, e)
+            lazy_logging.warning("Error occurred by executing rule %s %s", rule.function_name, e)
 
     def start(self):
         if not self.is_running:
@@ -59,9 +64,19 @@ class Processor(ABC):
     def on_stop(self):
         pass
 
+    def on_tick(self):
+        pass
+
     def on_add_rule(self, rule: Rule):
         pass
 
     def on_remove_rules(self, module: str):
         pass
 
+    def on_reload_started(self):
+        # all rule modules are (re)loaded, e.g. on startup
+        pass
+
+    def on_reload_completed(self):
+        pass
+
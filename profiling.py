@@ -0,0 +1,97 @@
+import io
+import logging
+import profile
+import pstats
+import sys
+from fnmatch import fnmatch
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+
+
+
+class RuleProfiler:
+    """
+    Profiles the next n invocations of the rules matching a pattern such as 'heating#*' (module#function).
+    The pure python profiler is used, because it profiles the calling thread only. Since python 3.12
+    cProfile records the calls of all threads, i.e. the statistics would include concurrent invocations
+    """
+
+    def __init__(self, pattern: str, num_invocations: int, listener = None):
+        self.pattern = pattern
+        self.num_invocations = num_invocations
+        self.num_profiled = 0
+        self.__listener = listener
+        self.__lock = Lock()
+        self.__stats: Optional[pstats.Stats] = None
+
+    @property
+    def is_completed(self) -> bool:
+        return self.num_profiled >= self.num_invocations
+
+    def matches(self, fullname: str) -> bool:
+        return fnmatch(fullname, self.pattern)
+
+    def run(self, func, *args):
+        if sys.getprofile() is not None:
+            # the calling thread is already profiled, e.g. by a debugger
+            return func(*args)
+        # wall clock time, rules usually wait for I/O
+        thread_profile = profile.Profile(timer=perf_counter)
+        try:
+            return thread_profile.runcall(func, *args)
+        finally:
+            self.__add(thread_profile)
+
+    def __add(self, thread_profile: profile.Profile):
+        with self.__lock:
+            if self.is_completed:
+                return
+            if self.__stats is None:
+                self.__stats = pstats.Stats(thread_profile)
+            else:
+                self.__stats.add(thread_profile)
+            self.num_profiled += 1
+            completed = self.is_completed
+        if completed:
+            stop_profiling(self)
+            logging.info("profiling of " + self.pattern + " completed (" + str(self.num_profiled) + " invocations)")
+            if self.__listener is not None:
+                self.__listener()
+
+    def report(self, max_lines: int = 50) -> str:
+        with self.__lock:
+            if self.__stats is None:
+                return "profiling " + self.pattern + ": no invocation profiled yet"
+            out = io.StringIO()
+            stats = pstats.Stats(stream=out)
+            stats.add(self.__stats)    # copy, to avoid changing the sort order of the collected stats
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(max_lines)
+        return "profiling " + self.pattern + ": " + str(self.num_profiled) + " of " + str(self.num_invocations) + " invocations\n" + out.getvalue()
+
+
+# the profiler of the running profiling session. None, if profiling is off
+active: Optional[RuleProfiler] = None
+# the profiler of the latest profiling session
+latest: Optional[RuleProfiler] = None
+
+
+def start_profiling(pattern: str, num_invocations: int, listener = None) -> RuleProfiler:
+    global active, latest
+    profiler = RuleProfiler(pattern, num_invocations, listener)
+    latest = profiler
+    active = profiler
+    logging.info("profiling next " + str(num_invocations) + " invocations of " + pattern)
+    return profiler
+
+
+def stop_profiling(profiler: Optional[RuleProfiler] = None):
+    global active
+    if profiler is None or active is profiler:
+        active = None
+
+
+def profiling_report() -> str:
+    if latest is None:
+        return ""
+    return latest.report()
@@ -1,13 +1,19 @@
 from rule import Rule
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 from invoke import InvokerManager
 from processor import Processor
 from device import DeviceRegistry, Device
+from event import PropertyChangedEvent, PropertyChangesEvent
+from causality import current_trace, current_trace_id
+from tracing import tracer
+from time import time
 
 
 
 class PropertyChangedRule(Rule):
 
+    __slots__ = ('property_name', 'device_name')
+
     def __init__(self, device_name: str, property_name: str, trigger_expression: str, func, invoker_manager: InvokerManager):
         self.property_name = property_name
         self.device_name = device_name
@@ -19,20 +25,63 @@ class PropertyChangedRule(Rule):
 
 class PropertyChangeProcessor(Processor):
 
+    TRIGGER_TYPE = "property"
+
     def __init__(self, device_registry: DeviceRegistry, invoker_manager: InvokerManager):
         super().__init__("Property change", device_registry, invoker_manager)
+        # routing table (device name, property name) -> rules. The rule lists are copy-on-write, they are read by the stream threads without locking
+        self.__routes: Dict[Tuple[str, str], List[PropertyChangedRule]] = {}
 
     def on_annotation(self, annotation: str, func) -> bool:
         if annotation.lower().startswith("property") and annotation.lower().endswith("changed"):
             device_property_pair = annotation[len("property"):len("changed") *-1].strip()
             device, property = device_property_pair.split("#")
-            self._device_registry.device(device).add_listener(self.__on_property_changed)
+            registered_device = self._device_registry.device(device)
+            if registered_device is None:
+                # the rules are reloaded, if the device becomes available
+                return True
+            if registered_device.is_remote:
+                return True    # processed by the shard the device is connected to
+            registered_device.add_listener(self.__on_property_changed)
             self.add_rule(PropertyChangedRule(device, property, annotation, func, self._invoker_manager))
             return True
         return False
 
-    def __on_property_changed(self, device: Device, properties: Dict[str, Any]):
-        for name, value in properties.items():
-            for changed_rule in [rule for rule in self.rules if rule.matches(device.name, name)]:
-                self.invoke_rule(changed_rule)
+    def on_add_rule(self, rule: Rule):
+        key = (rule.device_name, rule.property_name)
+        self.__routes[key] = [routed_rule for routed_rule in self.__routes.get(key, []) if routed_rule != rule] + [rule]
+
+    def on_remove_rules(self, module: str):
+        for key, rules in list(self.__routes.items()):
+            remaining_rules = [rule for rule in rules if rule.module != module]
+            if len(remaining_rules) == 0:
+                del self.__routes[key]
+            elif len(remaining_rules) < len(rules):
+                self.__routes[key] = remaining_rules
+
+    def __on_property_changed(self, device: Device, properties: Dict[str, Any], old_properties: Dict[str, Any]):
+        routes = self.__routes
+        trace_id = current_trace_id()
+        started = 0 if trace_id is None else time()
+        invoked_functions = set()
+        event = None
+        for name in properties.keys():
+            for changed_rule in routes.get((device.name, name), ()):
+                if event is None:
+                    event = PropertyChangesEvent.create(device.name, properties, old_properties, self.__initiator(device))
+                if changed_rule.event_type is PropertyChangedEvent:
+                    # a function expecting a single change is invoked for each change
+                    self.invoke_rule(changed_rule, event.change(name))
+                elif changed_rule.function not in invoked_functions:
+                    # other functions triggered by several properties of the same change are invoked once
+                    invoked_functions.add(changed_rule.function)
+                    self.invoke_rule(changed_rule, event)
+        if trace_id is not None:
+            tracer.span("dispatch", "processor", started, trace_id, device=device.name, properties=list(properties.keys()))
+
+    @staticmethod
+    def __initiator(device: Device) -> str:
+        # the rule which has written the property or the device itself
+        trace = current_trace()
+        return device.name if trace is None else trace.chain[-1]
 
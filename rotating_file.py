@@ -0,0 +1,54 @@
+import os
+from os.path import exists
+from threading import Lock
+
+
+
+class RotatingFile:
+    """
+    append-only file, which is rotated if it exceeds the max file size. The rotated files are
+    named <filename>.1 (latest) to <filename>.<max_files> (oldest)
+    """
+
+    def __init__(self, filename: str, max_file_size: int, max_files: int, binary: bool = True, header = None):
+        self.filename = filename
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        self.__mode = "ab" if binary else "a"
+        # written at the beginning of each file
+        self.__header = header
+        self.__lock = Lock()
+        self.__file = self.__open()
+
+    def __open(self):
+        file = open(self.filename, self.__mode)
+        if self.__header is not None and file.tell() == 0:
+            file.write(self.__header)
+        return file
+
+    def write(self, data, flush: bool = False):
+        with self.__lock:
+            self.__file.write(data)
+            if flush:
+                self.__file.flush()
+            if self.__file.tell() >= self.max_file_size:
+                self.__rotate()
+
+    def __rotate(self):
+        self.__file.close()
+        oldest = self.filename + "." + str(self.max_files)
+        if exists(oldest):
+            os.remove(oldest)
+        for i in range(self.max_files - 1, 0, -1):
+            if exists(self.filename + "." + str(i)):
+                os.replace(self.filename + "." + str(i), self.filename + "." + str(i + 1))
+        os.replace(self.filename, self.filename + ".1")
+        self.__file = self.__open()
+
+    def flush(self):
+        with self.__lock:
+            self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
@@ -1,27 +1,44 @@
-import logging
+import lazy_logging
 from datetime import datetime
+from typing import Optional
 from invoke import InvokerManager
 from device import DeviceRegistry
 
 
 class Rule:
 
+    __slots__ = ('trigger_expression', '__func', '__invoker', '__fingerprint', 'last_executed', 'last_failed')
+
     def __init__(self, trigger_expression: str, func, invoker_manager: InvokerManager):
         self.trigger_expression = trigger_expression
         self.__func = func
         self.__invoker = invoker_manager.new_invoker(func)
+        # rules are kept in sets. The identity is computed once (a str caches its hash)
+        self.__fingerprint = str(func.__module__) + "/" + str(func.__name__) + "/" + trigger_expression
         self.last_executed = None
         self.last_failed = None
 
-    def invoke(self, device_registry: DeviceRegistry, initiator: str):
+    def invoke(self, device_registry: DeviceRegistry, initiator: str, event = None):
         try:
-            logging.debug('executing ' + self.module + '.py#' + self.function_name + '(...) on @when("' + self.trigger_expression + '")')
-            self.__invoker.invoke(device_registry, initiator)
+            lazy_logging.debug('executing %s.py#%s(...) on @when("%s")', self.__func.__module__, self.__func.__name__, self.trigger_expression)
+            self.__invoker.invoke(device_registry, initiator, self.on_executed, event)
             self.last_executed = datetime.now()
         except Exception as e:
-            logging.warning("Error occurred by executing rule " + self.function_name, e)
+            lazy_logging.warning("Error occurred by executing rule %s %s", self.function_name, e)
             self.last_failed = datetime.now()
 
+    def on_executed(self, device_registry: DeviceRegistry):
+        pass
+
+    @property
+    def event_type(self) -> Optional[type]:
+        # the event type expected by the function (PropertyChangedEvent or PropertyChangesEvent), if any
+        return None if self.__invoker is None else self.__invoker.event_type
+
+    @property
+    def function(self):
+        return self.__func
+
     @property
     def module(self) -> str:
         return self.__func.__module__
@@ -31,14 +48,14 @@ class Rule:
         return self.__func.__name__
 
     def fingerprint(self) -> str:
-        return str(self.module) + "/" + str(self.function_name) + "/" + self.trigger_expression
+        return self.__fingerprint
 
     def __hash__(self):
-        return hash(self.fingerprint())
+        return hash(self.__fingerprint)
 
     def __eq__(self, other):
-        return self.fingerprint() == other.fingerprint()
+        return self.__fingerprint == other.fingerprint()
 
     def __lt__(self, other):
-        return self.fingerprint() < other.fingerprint()
+        return self.__fingerprint < other.fingerprint()
 
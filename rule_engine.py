@@ -1,34 +1,55 @@
 import logging
+import os
 import sys
 import importlib
 from time import sleep
 from device import DeviceManager
 from rule_loader import RuleLoader
-from source_scanner import parse_function_annotations
+from source_scanner import AnnotationCache
+from dispatch_plan import DispatchPlan
 from loaded_rule_processor import RuleLoadedProcessor
 from cron_processor import CronProcessor
 from device import Store
 from property_change_processor import PropertyChangeProcessor
+from inputs_changed_processor import InputsChangedProcessor
 from invoke import InvokerManager
-from webthing import (MultipleThings, WebThingServer)
+from clock import Clock
+from scheduling import load_policies
+from typing import Optional, List
+from webthing import (MultipleThings, WebThingServer, Thing)
 from db_webthing import StoreThing
 from rule_webthing import RuleThing
+from websocket_consumer import EventConsumer
+from event_recorder import EventRecorder
+from sharding import run_sharded_server
+from lazy_logging import trace_sampler
+from tracing import tracer, SpanExporter
 
 
 
 class RuleEngine():
 
-    def __init__(self, directory: str):
+    def __init__(self, directory: str, device_manager: Optional[DeviceManager] = None, invocation_manager: Optional[InvokerManager] = None, clock: Optional[Clock] = None, primary: bool = True):
         self.__is_running = False
         self.__listener = lambda: None    # "empty" listener
         self.__directory = directory
-        self.__invocation_manager = InvokerManager()
-        self.__rule_loader = RuleLoader(self.__load_module, self.__unload_module, directory)
-        self._device_manager = DeviceManager(directory)
+        self.__invocation_manager = InvokerManager() if invocation_manager is None else invocation_manager
+        self.__rule_loader = RuleLoader(self.__load_module, self.__unload_module, directory, self.__on_reload_started, self.__on_reload_completed)
+        self.__annotation_cache = AnnotationCache(directory)
+        self._device_manager = DeviceManager(directory) if device_manager is None else device_manager
         self._device_manager.add_change_listener(self.__rule_loader.reload)
-        self.__processors = [RuleLoadedProcessor(self._device_manager, self.__invocation_manager),
-                             CronProcessor(self._device_manager, self.__invocation_manager),
-                             PropertyChangeProcessor(self._device_manager, self.__invocation_manager)]
+        self.__primary = primary
+        self.__processors = [PropertyChangeProcessor(self._device_manager, self.__invocation_manager)]
+        if primary:
+            # secondary engines of a sharded setup process the 'Property changed' rules of their devices only
+            self.__processors = [RuleLoadedProcessor(self._device_manager, self.__invocation_manager),
+                                 CronProcessor(self._device_manager, self.__invocation_manager, clock),
+                                 PropertyChangeProcessor(self._device_manager, self.__invocation_manager),
+                                 InputsChangedProcessor(self._device_manager, self.__invocation_manager)]
+
+    @property
+    def invocation_manager(self) -> InvokerManager:
+        return self.__invocation_manager
 
     def set_listener(self, listener):
         self.__listener = listener
@@ -37,6 +58,7 @@ class RuleEngine():
         self.__is_running = False
         self.__rule_loader.close()
         self._device_manager.close()
+        EventConsumer.close_recorder()
 
     def start(self):
         logging.info("starting rule engine...")
@@ -44,6 +66,9 @@ class RuleEngine():
         if self.__directory not in sys.path:
             sys.path.insert(0, self.__directory )
         logging.info("starting invocation manager")
+        policies = load_policies(self.__directory)
+        if len(policies) > 0:
+            self.__invocation_manager.set_policies(policies)
         self.__invocation_manager.start()
         logging.info("starting device_manager")
         self._device_manager.start()
@@ -51,6 +76,17 @@ class RuleEngine():
         self.__rule_loader.start()
         logging.info("rule engine started")
 
+    def tick(self):
+        # drives time based processors if a virtual clock is used
+        [processor.on_tick() for processor in self.__processors]
+
+    def __on_reload_started(self):
+        [processor.on_reload_started() for processor in self.__processors]
+
+    def __on_reload_completed(self):
+        self.__annotation_cache.save()
+        [processor.on_reload_completed() for processor in self.__processors]
+
     def __load_module(self, filename: str):
         if filename.endswith(".py"):
             try:
@@ -63,9 +99,13 @@ class RuleEngine():
                 else:
                     importlib.import_module(modulename)
                     msg = "file '" + filename + "' loaded"
-                function_annotations = parse_function_annotations(modulename)
-                if len(function_annotations) > 0:
-                    [processor.on_annotations(function_annotations) for processor in self.__processors]
+                plan = DispatchPlan.compile(modulename, self.__annotation_cache.parse_function_annotations(modulename))
+                if len(plan) > 0:
+                    for processor in self.__processors:
+                        processor.on_annotations(plan.annotations_of(processor.TRIGGER_TYPE))
+                    if self.__primary:
+                        for func, annotation in plan.unrouted([processor.TRIGGER_TYPE for processor in self.__processors]):
+                            logging.warning(filename + "#" + func.__name__ + " unsupported trigger @when(\"" + annotation + "\")")
                     logging.info(msg)
                 else:
                     logging.info("file '" + filename + "' ignored (no annotations)")
@@ -89,8 +129,11 @@ class RuleEngine():
 
 
 
-def run_webthing_server(description: str, port: int, device_manager: DeviceManager):
-    server = WebThingServer(MultipleThings([RuleThing(description, device_manager), StoreThing(description, device_manager.device(Store.NAME))], "engine"), port=port, disable_host_validation=True)
+def run_webthing_server(description: str, port: int, device_manager: DeviceManager, invoker_manager: InvokerManager, additional_things: List[Thing] = None):
+    things = [RuleThing(description, device_manager, invoker_manager), StoreThing(description, device_manager.device(Store.NAME))]
+    if additional_things is not None:
+        things = things + additional_things
+    server = WebThingServer(MultipleThings(things, "engine"), port=port, disable_host_validation=True)
     try:
         logging.info('starting the server http://localhost:' + str(port))
         server.start()
@@ -99,21 +142,36 @@ def run_webthing_server(description: str, port: int, device_manager: DeviceManag
         server.stop()
         logging.info('done')
 
-def run_server(directory: str, port: int):
+def run_server(directory: str, port: int, record_directory: Optional[str] = None):
+    if record_directory is not None:
+        logging.info('recording device events (dir: ' + record_directory + ')')
+        EventConsumer.recorder = EventRecorder(record_directory)
     rule_engine = RuleEngine(directory)
     try:
         logging.info('starting rule engine (rules dir: ' + directory + ')')
         rule_engine.start()
-        run_webthing_server("", port, rule_engine._device_manager)
+        run_webthing_server("", port, rule_engine._device_manager, rule_engine.invocation_manager)
 
     except KeyboardInterrupt:
         logging.info('stopping rule engine')
         rule_engine.stop()
         logging.info('done')
+    finally:
+        # the webthing server handles the KeyboardInterrupt itself
+        EventConsumer.close_recorder()
 
 
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(name)-20s: %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
     logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
     logging.getLogger('tornado.access').setLevel(logging.ERROR)
-    run_server(sys.argv[1], int(sys.argv[2]))
+    sample_rate = float(os.environ.get('LOG_TRACE_SAMPLE_RATE', '0'))
+    trace_sampler.set_sample_rate(sample_rate)
+    if os.environ.get('TRACE_DIR', None) is not None:
+        # same rate as the trace log, but sampled independently
+        tracer.configure(SpanExporter(os.environ['TRACE_DIR']), sample_rate)
+    num_shards = int(os.environ.get('NUM_SHARDS', '1'))
+    if num_shards > 1:
+        run_sharded_server(sys.argv[1], int(sys.argv[2]), num_shards, os.environ.get('RECORD_DIR', None))
+    else:
+        run_server(sys.argv[1], int(sys.argv[2]), os.environ.get('RECORD_DIR', None))
@@ -1,5 +1,13 @@
 import os
 import logging
+import compileall
+import importlib.util
+import multiprocessing
+from functools import partial
+from os.path import join
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -7,20 +15,61 @@ from watchdog.events import FileSystemEventHandler
 
 class RuleLoader(FileSystemEventHandler):
 
-    def __init__(self, load_listener, unload_listener, dir):
+    # compiling in worker processes pays off for many changed files only (starting a worker takes a while)
+    MIN_FILES_TO_COMPILE_CONCURRENTLY = 8
+    MAX_COMPILE_WORKERS = 4
+
+    def __init__(self, load_listener, unload_listener, dir, reload_started_listener = None, reload_completed_listener = None):
         self.load_listener = load_listener
         self.unload_listener = unload_listener
+        self.reload_started_listener = (lambda: None) if reload_started_listener is None else reload_started_listener
+        self.reload_completed_listener = (lambda: None) if reload_completed_listener is None else reload_completed_listener
         self.dir = dir
         self.observer = Observer()
+        # filename -> elapsed sec of the latest (re)load
+        self.load_times: Dict[str, float] = {}
 
     def __unload_module(self, path: str):
         self.unload_listener(path)
 
     def __load_module(self, path: str):
+        started = perf_counter()
         try:
             self.load_listener(path)
         except Exception as e:
             logging.error(e)
+        self.load_times[path] = perf_counter() - started
+
+    @staticmethod
+    def __is_stale(path: str) -> bool:
+        # the cached bytecode does not exist or does not match the source (see PEP 552)
+        try:
+            with open(importlib.util.cache_from_source(path), "rb") as file:
+                header = file.read(16)
+            stat = os.stat(path)
+            if len(header) < 16 or header[:4] != importlib.util.MAGIC_NUMBER:
+                return True
+            if int.from_bytes(header[4:8], "little") != 0:
+                return False    # hash based bytecode is validated by the import
+            return int.from_bytes(header[8:12], "little") != (int(stat.st_mtime) & 0xFFFFFFFF) or int.from_bytes(header[12:16], "little") != (stat.st_size & 0xFFFFFFFF)
+        except OSError:
+            return True
+
+    def __compile(self, filenames: List[str]):
+        # writes the cached bytecode of the changed files in parallel. The subsequent import reads the cached bytecode
+        stale_paths = [join(self.dir, filename) for filename in filenames if self.__is_stale(join(self.dir, filename))]
+        if len(stale_paths) < self.MIN_FILES_TO_COMPILE_CONCURRENTLY:
+            return    # compiled by the import
+        if multiprocessing.current_process().daemon:
+            # a daemon process (e.g. a shard) is not allowed to start worker processes. The shards load their rules in parallel anyway
+            return
+        try:
+            # spawn, because forking a process with running threads is unsafe
+            with ProcessPoolExecutor(max_workers=min(self.MAX_COMPILE_WORKERS, os.cpu_count() or 1), mp_context=multiprocessing.get_context("spawn")) as executor:
+                list(executor.map(partial(compileall.compile_file, quiet=2), stale_paths))
+            logging.info(str(len(stale_paths)) + " changed files compiled")
+        except Exception as e:
+            logging.warning("error occurred compiling rule files " + str(e))
 
     def start(self):
         try:
@@ -32,13 +81,25 @@ class RuleLoader(FileSystemEventHandler):
             logging.error("error occurred starting file listener " + str(e))
 
     def reload(self):
+        self.reload_started_listener()
         try:
-            files = [file for file in os.scandir(self.dir) if file.name.endswith(".py")]
-            logging.debug(str(len(files)) + " files found: " + ", ".join([file.name for file in files]))
-            for file in files:
-                self.__load_module(file.name)
+            # sorted to load the modules in a deterministic order
+            filenames = sorted([file.name for file in os.scandir(self.dir) if file.name.endswith(".py")])
+            logging.debug(str(len(filenames)) + " files found: " + ", ".join(filenames))
+            started = perf_counter()
+            self.__compile(filenames)
+            compiled = perf_counter()
+            for filename in filenames:
+                self.__load_module(filename)
+            if len(filenames) > 0:
+                slowest = sorted(filenames, key=lambda filename: self.load_times.get(filename, 0), reverse=True)[:5]
+                logging.info(str(len(filenames)) + " files loaded in " + str(int((perf_counter() - started) * 1000)) + " ms (compile " +
+                             str(int((compiled - started) * 1000)) + " ms). Slowest: " +
+                             ", ".join([filename + " " + str(int(self.load_times.get(filename, 0) * 1000)) + " ms" for filename in slowest]))
         except Exception as e:
             logging.error("error occurred starting file listener " + str(e))
+        finally:
+            self.reload_completed_listener()
 
     def close(self):
         self.observer.stop()
@@ -1,6 +1,9 @@
+import logging
+import profiling
 import tornado.ioloop
 from webthing import (Property, Thing, Value)
 from device import DeviceManager
+from invoke import InvokerManager
 
 
 
@@ -10,7 +13,7 @@ class RuleThing(Thing):
     # regarding capabilities refer https://iot.mozilla.org/schemas
     # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
 
-    def __init__(self, description: str, device_manager: DeviceManager):
+    def __init__(self, description: str, device_manager: DeviceManager, invoker_manager: InvokerManager):
         Thing.__init__(
             self,
             'urn:dev:ops:device_manager-1',
@@ -34,6 +37,93 @@ class RuleThing(Thing):
                          'readOnly': True,
                      }))
 
+        self.invoker_manager = invoker_manager
+        self.cascades = Value(str(self.invoker_manager.cascade_monitor))
+        self.add_property(
+            Property(self,
+                     'cascades',
+                     self.cascades,
+                     metadata={
+                         'title': 'cascades',
+                         "type": "string",
+                         'description': 'statistics of rule invocations caused by property writes of other rules',
+                         'readOnly': True,
+                     }))
+        tornado.ioloop.PeriodicCallback(self.__on_statistics_timer, 10 * 1000).start()
+
+        self.device_health = Value(self.__device_health)
+        self.add_property(
+            Property(self,
+                     'device_health',
+                     self.device_health,
+                     metadata={
+                         'title': 'device health',
+                         "type": "string",
+                         'description': 'comma separated list of the devices which have failed recently including the circuit breaker state. Empty, if all devices are healthy',
+                         'readOnly': True,
+                     }))
+
+        self.batching = Value(self.__batching)
+        self.add_property(
+            Property(self,
+                     'batching',
+                     self.batching,
+                     metadata={
+                         'title': 'batching',
+                         "type": "string",
+                         'description': 'micro-batching statistics of the devices with a batch window (batch_window_ms of webthings.yml)',
+                         'readOnly': True,
+                     }))
+
+        self.running = Value(self.__running_invocations)
+        self.add_property(
+            Property(self,
+                     'running',
+                     self.running,
+                     metadata={
+                         'title': 'running',
+                         "type": "string",
+                         'description': 'comma separated list of the running rule invocations',
+                         'readOnly': True,
+                     }))
+        self.invoker_manager.add_listener(self.on_running_changed)
+
+        self.queues = Value(self.__queue_statistics)
+        self.add_property(
+            Property(self,
+                     'queues',
+                     self.queues,
+                     metadata={
+                         'title': 'queues',
+                         "type": "string",
+                         'description': 'queue depth, running invocations and wait times per rule module (scheduling policies of scheduling.yml)',
+                         'readOnly': True,
+                     }))
+
+        self.profile = Value("", self.__on_profile_updated)
+        self.add_property(
+            Property(self,
+                     'profile',
+                     self.profile,
+                     metadata={
+                         'title': 'profile',
+                         "type": "string",
+                         'description': 'profiles the next invocations of the matching rules. Format: <module>#<function pattern>[:<num invocations>], e.g. heating#*:100. Empty to stop profiling',
+                         'readOnly': False,
+                     }))
+
+        self.profile_report = Value(profiling.profiling_report())
+        self.add_property(
+            Property(self,
+                     'profile_report',
+                     self.profile_report,
+                     metadata={
+                         'title': 'profile report',
+                         "type": "string",
+                         'description': 'cumulative profile statistics of the latest profiling',
+                         'readOnly': True,
+                     }))
+
     @property
     def __devicenames(self) -> str:
         return ", ".join(sorted([device.name for device in self.device_manager.devices]))
@@ -43,3 +133,51 @@ class RuleThing(Thing):
 
     def _on_value_changed(self):
         self.devices.notify_of_external_update(self.__devicenames)
+
+    @property
+    def __batching(self) -> str:
+        batchers = [device.batcher for device in self.device_manager.devices if getattr(device, 'batcher', None) is not None]
+        return ", ".join(sorted([str(batcher) for batcher in batchers]))
+
+    @property
+    def __device_health(self) -> str:
+        unhealthy_devices = [device for device in self.device_manager.devices if getattr(device, 'health', None) is not None and not device.health.is_healthy]
+        return ", ".join(sorted([device.name + ": " + str(device.health) for device in unhealthy_devices]))
+
+    @property
+    def __queue_statistics(self) -> str:
+        return ", ".join(self.invoker_manager.queue_statistics())
+
+    @property
+    def __running_invocations(self) -> str:
+        return ", ".join(self.invoker_manager.running_invocations())
+
+    def on_running_changed(self):
+        self.ioloop.add_callback(self._on_running_changed)
+
+    def _on_running_changed(self):
+        self.running.notify_of_external_update(self.__running_invocations)
+
+    def __on_profile_updated(self, profile: str):
+        profile = profile.strip()
+        if len(profile) == 0:
+            profiling.stop_profiling()
+            self.on_profile_report_changed()
+        else:
+            pattern, _, num_invocations = profile.partition(":")
+            try:
+                profiling.start_profiling(pattern.strip(), int(num_invocations) if len(num_invocations.strip()) > 0 else 100, self.on_profile_report_changed)
+            except ValueError as e:
+                logging.warning("invalid profile " + profile + " " + str(e))
+
+    def on_profile_report_changed(self):
+        self.ioloop.add_callback(self._on_profile_report_changed)
+
+    def _on_profile_report_changed(self):
+        self.profile_report.notify_of_external_update(profiling.profiling_report())
+
+    def __on_statistics_timer(self):
+        self.cascades.notify_of_external_update(str(self.invoker_manager.cascade_monitor))
+        self.device_health.notify_of_external_update(self.__device_health)
+        self.batching.notify_of_external_update(self.__batching)
+        self.queues.notify_of_external_update(self.__queue_statistics)
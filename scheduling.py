@@ -0,0 +1,170 @@
+import logging
+import yaml
+from collections import deque
+from os.path import join, exists
+from queue import Empty
+from threading import Condition
+from time import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+
+class ModulePolicy:
+
+    def __init__(self, weight: int = 1, max_concurrency: Optional[int] = None, reserved_runners: int = 0):
+        # share of the invocations if several modules are waiting
+        self.weight = max(1, weight)
+        # max number of concurrently running invocations of the module. None means unlimited
+        self.max_concurrency = max_concurrency
+        # additional runners which process invocations of the module only
+        self.reserved_runners = max(0, reserved_runners)
+
+    def __str__(self):
+        return "weight=" + str(self.weight) + " max_concurrency=" + str(self.max_concurrency) + " reserved_runners=" + str(self.reserved_runners)
+
+
+def load_policies(directory: str, filename: str = "scheduling.yml") -> Dict[str, ModulePolicy]:
+    """
+    reads the optional scheduling policies of the rule modules, e.g.
+    heating:
+      weight: 3
+      max_concurrency: 2
+      reserved_runners: 1
+    """
+    policies = {}
+    file = join(directory, filename)
+    if exists(file):
+        try:
+            with open(file) as f:
+                for module, config in (yaml.safe_load(f) or {}).items():
+                    config = config or {}
+                    policies[module] = ModulePolicy(int(config.get('weight', 1)),
+                                                    None if config.get('max_concurrency', None) is None else int(config['max_concurrency']),
+                                                    int(config.get('reserved_runners', 0)))
+                    logging.info("scheduling policy of " + module + ": " + str(policies[module]))
+        except Exception as e:
+            logging.warning("error occurred reading " + file + " " + str(e))
+    return policies
+
+
+class _ModuleQueue:
+
+    def __init__(self, module: str, policy: ModulePolicy):
+        self.module = module
+        self.policy = policy
+        self.entries: Deque[Tuple[float, Any]] = deque()
+        self.deficit = 0
+        self.running = 0
+        self.num_dispatched = 0
+        self.total_wait_sec = 0.0
+        self.max_wait_sec = 0.0
+
+    def is_eligible(self) -> bool:
+        return len(self.entries) > 0 and (self.policy.max_concurrency is None or self.running < self.policy.max_concurrency)
+
+    def pop(self):
+        enqueued, invocation = self.entries.popleft()
+        wait_sec = time() - enqueued
+        self.deficit -= 1
+        self.running += 1
+        self.num_dispatched += 1
+        self.total_wait_sec += wait_sec
+        self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+        if len(self.entries) == 0:
+            self.deficit = 0
+        return invocation
+
+    def __str__(self):
+        avg_wait_ms = 0 if self.num_dispatched == 0 else round(self.total_wait_sec * 1000 / self.num_dispatched, 1)
+        return self.module + ": queued=" + str(len(self.entries)) + " running=" + str(self.running) + " dispatched=" + str(self.num_dispatched) + \
+               " avg_wait_ms=" + str(avg_wait_ms) + " max_wait_ms=" + str(round(self.max_wait_sec * 1000, 1))
+
+
+class FairQueue:
+    """
+    invocation queue with a FIFO per rule module. The modules are served by deficit round-robin
+    according to their weight, i.e. a module with many pending invocations cannot starve the others
+    """
+
+    def __init__(self, policies: Dict[str, ModulePolicy] = None):
+        self.policies = {} if policies is None else policies
+        # without caps and reservations each waiting runner is able to process a new invocation, i.e. waking up one runner is sufficient
+        self.__is_restricted = any([policy.max_concurrency is not None or policy.reserved_runners > 0 for policy in self.policies.values()])
+        self.__condition = Condition()
+        self.__queues: Dict[str, _ModuleQueue] = {}
+        # modules with pending invocations in round-robin order. The first one is served next
+        self.__active: Deque[_ModuleQueue] = deque()
+
+    def __queue_of(self, module: str) -> _ModuleQueue:
+        queue = self.__queues.get(module, None)
+        if queue is None:
+            queue = _ModuleQueue(module, self.policies.get(module, ModulePolicy()))
+            self.__queues[module] = queue
+        return queue
+
+    def put(self, invocation):
+        with self.__condition:
+            queue = self.__queue_of(invocation.module)
+            if len(queue.entries) == 0:
+                self.__active.append(queue)
+            queue.entries.append((time(), invocation))
+            if self.__is_restricted:
+                self.__condition.notify_all()
+            else:
+                self.__condition.notify()
+
+    def get(self, module: Optional[str] = None, timeout: float = None):
+        # module is set for reserved runners, which process the invocations of this module only
+        deadline = None if timeout is None else time() + timeout
+        with self.__condition:
+            while True:
+                invocation = self.__next(module)
+                if invocation is not None:
+                    return invocation
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    raise Empty()
+                self.__condition.wait(remaining)
+
+    def __next(self, module: Optional[str]):
+        if module is not None:
+            queue = self.__queues.get(module, None)
+            if queue is None or not queue.is_eligible():
+                return None
+            invocation = queue.pop()
+            if len(queue.entries) == 0:
+                self.__active.remove(queue)
+            return invocation
+
+        # deficit round-robin. A module is served as long as it has deficit, then the next module gets its quantum
+        for _ in range(len(self.__active)):
+            queue = self.__active[0]
+            if queue.is_eligible():
+                if queue.deficit < 1:
+                    queue.deficit += queue.policy.weight
+                invocation = queue.pop()
+                if len(queue.entries) == 0:
+                    self.__active.popleft()
+                elif queue.deficit < 1:
+                    self.__active.rotate(-1)
+                return invocation
+            else:
+                # capped. Skipped without losing its deficit
+                self.__active.rotate(-1)
+        return None
+
+    def done(self, invocation):
+        with self.__condition:
+            queue = self.__queues.get(invocation.module, None)
+            if queue is not None:
+                queue.running -= 1
+                if len(queue.entries) > 0:
+                    self.__condition.notify_all()
+
+    def qsize(self) -> int:
+        with self.__condition:
+            return sum([len(queue.entries) for queue in self.__queues.values()])
+
+    def statistics(self) -> List[str]:
+        with self.__condition:
+            return sorted([str(queue) for queue in self.__queues.values()])
@@ -0,0 +1,442 @@
+import os
+import sys
+import signal
+import logging
+import hashlib
+import tornado.ioloop
+from multiprocessing import Process
+from multiprocessing.connection import Listener as ConnectionListener, Client, Connection
+from threading import Thread, Lock
+from time import sleep
+from typing import Any, Dict, List, Optional, Tuple
+from webthing import (Property, Thing, Value)
+from os.path import join
+from device import Device, DeviceManager, Store, Webthing
+from invoke import InvokerManager
+from causality import CausalTrace, current_trace, set_current_trace
+
+
+
+class ShardMap:
+
+    def __init__(self, num_shards: int):
+        self.num_shards = num_shards
+        # the store is served by the webthing server of the primary shard
+        self.__pinned = {Store.NAME: 0}
+
+    def shard_of(self, device_name: str) -> int:
+        # rendezvous hashing. A new device is placed without moving others; changing the number of shards moves 1/n of the devices only
+        shard = self.__pinned.get(device_name, None)
+        if shard is None:
+            shard = max(range(self.num_shards), key=lambda candidate: self.__weight(device_name, candidate))
+        return shard
+
+    def __weight(self, device_name: str, shard: int) -> int:
+        # stable across processes (other than hash())
+        return int.from_bytes(hashlib.md5((device_name + "#" + str(shard)).encode("utf-8")).digest()[:8], "big")
+
+
+def _trace_of(trace: Optional[CausalTrace]) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    # the causal trace is passed to other shards to detect and limit cascades across shards
+    return None if trace is None else (trace.initiator, trace.chain)
+
+
+def _restore_trace(trace: Optional[Tuple[str, Tuple[str, ...]]]) -> Optional[CausalTrace]:
+    return None if trace is None else CausalTrace(trace[0], trace[1])
+
+
+class ShardClient:
+
+    # idle connections kept for reuse. Concurrent requests use additional connections
+    MAX_IDLE_CONNECTIONS = 4
+
+    def __init__(self, shard: int, address: Tuple[str, int], authkey: bytes):
+        self.shard = shard
+        self.__address = address
+        self.__authkey = authkey
+        self.__lock = Lock()
+        self.__idle_connections: List[Connection] = []
+        self.__subscriptions: Dict[str, Any] = {}
+        self.__subscription_lock = Lock()
+        self.__subscription_connection: Optional[Connection] = None
+        self.__is_receiving = False
+
+    def request(self, *request) -> Any:
+        # the lock is held to take a connection only, i.e. a slow request does not block other requests
+        with self.__lock:
+            connection = self.__idle_connections.pop() if len(self.__idle_connections) > 0 else None
+        try:
+            if connection is None:
+                connection = Client(self.__address, authkey=self.__authkey)
+            connection.send(request)
+            status, result = connection.recv()
+        except Exception as e:
+            self.__close(connection)
+            raise Exception("error occurred calling shard " + str(self.shard) + " " + str(e)) from e
+        with self.__lock:
+            if len(self.__idle_connections) < self.MAX_IDLE_CONNECTIONS:
+                self.__idle_connections.append(connection)
+                connection = None
+        self.__close(connection)
+        if status == "error":
+            raise Exception("shard " + str(self.shard) + " returns error " + str(result))
+        return result
+
+    def subscribe(self, device_name: str, on_changed):
+        with self.__subscription_lock:
+            self.__subscriptions[device_name] = on_changed
+            if not self.__is_receiving:
+                self.__is_receiving = True
+                Thread(target=self.__receive_changes, daemon=True).start()
+            elif self.__subscription_connection is not None:
+                self.__send_subscribe(device_name)
+
+    def __send_subscribe(self, device_name: str):
+        try:
+            self.__subscription_connection.send(("subscribe", device_name))
+        except Exception as e:
+            logging.warning("error occurred subscribing " + device_name + " on shard " + str(self.shard) + " " + str(e))
+
+    def __receive_changes(self):
+        while True:
+            connection = None
+            try:
+                connection = Client(self.__address, authkey=self.__authkey)
+                with self.__subscription_lock:
+                    self.__subscription_connection = connection
+                    for device_name in self.__subscriptions.keys():
+                        self.__send_subscribe(device_name)
+                while True:
+                    _, device_name, properties, old_properties, trace = connection.recv()
+                    on_changed = self.__subscriptions.get(device_name, None)
+                    if on_changed is not None:
+                        set_current_trace(_restore_trace(trace))
+                        try:
+                            on_changed(properties, old_properties)
+                        finally:
+                            set_current_trace(None)
+            except Exception as e:
+                logging.warning("error occurred receiving changes of shard " + str(self.shard) + " " + str(e))
+            with self.__subscription_lock:
+                self.__subscription_connection = None
+            self.__close(connection)
+            sleep(3)
+
+    def __close(self, connection: Optional[Connection]):
+        try:
+            if connection is not None:
+                connection.close()
+        except Exception as e:
+            pass
+
+
+class RemoteDevice(Device):
+
+    is_remote = True
+
+    def __init__(self, name: str, client: ShardClient):
+        super().__init__(name)
+        self.__client = client
+        self.__is_subscribed = False
+
+    def add_listener(self, change_listener):
+        super().add_listener(change_listener)
+        if not self.__is_subscribed:
+            self.__is_subscribed = True
+            self.__client.subscribe(self.name, self.__on_property_changed)
+
+    def __on_property_changed(self, properties: Dict[str, Any], old_properties: Dict[str, Any]):
+        self._properties.update(properties)
+        self._notify_listener(properties, old_properties)
+
+    @property
+    def property_names(self) -> List[str]:
+        try:
+            return self.__client.request("property_names", self.name)
+        except Exception as e:
+            logging.warning(self.name + " " + str(e))
+            return []
+
+    def get_property(self, prop_name: str, dflt = None, force_loading: bool = False) -> Any:
+        try:
+            value = self.__client.request("get", self.name, prop_name, force_loading)
+        except Exception as e:
+            logging.warning(self.name + " " + str(e))
+            value = None
+        return dflt if value is None else value
+
+    def cached_properties(self) -> Dict[str, Any]:
+        try:
+            return self.__client.request("cached_properties", self.name)
+        except Exception as e:
+            logging.warning(self.name + " " + str(e))
+            return {}
+
+    def cached_property(self, prop_name: str) -> Any:
+        if self.__is_subscribed:
+            # kept up-to-date by the subscription and by the writes
+            return self._properties.get(prop_name, None)
+        try:
+            return self.__client.request("cached_property", self.name, prop_name)
+        except Exception as e:
+            logging.warning(self.name + " " + str(e))
+            return None
+
+    def set_property(self, prop_name: str, value: Any, reason: str = None):
+        try:
+            # returns the value accepted by the device
+            accepted_value = self.__client.request("set", self.name, prop_name, value, reason, _trace_of(current_trace()))
+            if self.__is_subscribed:
+                if accepted_value is None:
+                    self._properties.pop(prop_name, None)
+                else:
+                    self._properties[prop_name] = accepted_value
+        except Exception as e:
+            logging.warning(self.name + " " + str(e))
+
+    def __str__(self):
+        return self.name + " (shard " + str(self.__client.shard) + ")"
+
+
+class ShardServer:
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes, device_manager: DeviceManager):
+        self.__listener = ConnectionListener(address, authkey=authkey)
+        self.__device_manager = device_manager
+        self.__lock = Lock()
+        # subscriptions of devices which are not (yet) loaded by this shard
+        self.__pending_subscriptions: List[Tuple[Connection, Lock, str]] = []
+        self.__device_manager.add_change_listener(self.__on_devices_changed)
+
+    def start(self):
+        Thread(target=self.__accept, daemon=True).start()
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.__listener.accept()
+                Thread(target=self.__serve, args=(connection,), daemon=True).start()
+            except Exception as e:
+                logging.warning("error occurred accepting shard connection " + str(e))
+
+    def __serve(self, connection: Connection):
+        send_lock = Lock()
+        try:
+            while True:
+                request = connection.recv()
+                if request[0] == "subscribe":
+                    self.__subscribe(connection, send_lock, request[1])
+                    continue
+                try:
+                    response = ("ok", self.__handle(*request))
+                except Exception as e:
+                    response = ("error", str(e))
+                with send_lock:
+                    connection.send(response)
+        except EOFError as e:
+            pass
+        except Exception as e:
+            logging.warning("error occurred serving shard connection " + str(e))
+        finally:
+            connection.close()
+
+    def __handle(self, operation: str, device_name: str, *args) -> Any:
+        device = self.__device_manager.device(device_name)
+        if device is None:
+            raise Exception("device " + device_name + " not available")
+        if operation == "get":
+            prop_name, force_loading = args
+            return device.get_property(prop_name, force_loading=force_loading)
+        elif operation == "set":
+            prop_name, value, reason, trace = args
+            # invocations caused by the write are part of the cascade of the remote rule
+            set_current_trace(_restore_trace(trace))
+            try:
+                device.set_property(prop_name, value, reason)
+                return device.cached_property(prop_name)
+            finally:
+                set_current_trace(None)
+        elif operation == "property_names":
+            return device.property_names
+        elif operation == "cached_properties":
+            return device.cached_properties()
+        elif operation == "cached_property":
+            return device.cached_property(args[0])
+        else:
+            raise Exception("unsupported operation " + operation)
+
+    def __on_devices_changed(self):
+        with self.__lock:
+            pending_subscriptions = self.__pending_subscriptions
+            self.__pending_subscriptions = []
+        for connection, send_lock, device_name in pending_subscriptions:
+            if not connection.closed:
+                self.__subscribe(connection, send_lock, device_name)
+
+    def __subscribe(self, connection: Connection, send_lock: Lock, device_name: str):
+        device = self.__device_manager.device(device_name)
+        if device is None:
+            logging.info("device " + device_name + " not available. Subscription is pending")
+            with self.__lock:
+                self.__pending_subscriptions.append((connection, send_lock, device_name))
+            return
+
+        def on_property_changed(changed_device: Device, properties: Dict[str, Any], old_properties: Dict[str, Any]):
+            try:
+                with send_lock:
+                    connection.send(("changed", changed_device.name, properties, old_properties, _trace_of(current_trace())))
+            except Exception as e:
+                changed_device.change_listeners.discard(on_property_changed)
+
+        device.add_listener(on_property_changed)
+
+
+class ShardDeviceManager(DeviceManager):
+
+    def __init__(self, dir: str, shard: int, shard_map: ShardMap, clients: Dict[int, ShardClient]):
+        self.shard = shard
+        self.shard_map = shard_map
+        self.__clients = clients
+        super().__init__(dir)
+
+    def _create_store(self) -> Device:
+        shard = self.shard_map.shard_of(Store.NAME)
+        if shard == self.shard:
+            return super()._create_store()
+        else:
+            return RemoteDevice(Store.NAME, self.__clients[shard])
+
+    def _create_device(self, name: str, uri: str) -> Device:
+        shard = self.shard_map.shard_of(name)
+        if shard == self.shard:
+            return Webthing(name, uri)
+        else:
+            return RemoteDevice(name, self.__clients[shard])
+
+    def shard_assignments(self) -> Dict[str, int]:
+        return {device.name: self.shard_map.shard_of(device.name) for device in self.devices}
+
+
+class ShardThing(Thing):
+
+    def __init__(self, description: str, device_manager: ShardDeviceManager):
+        Thing.__init__(
+            self,
+            'urn:dev:ops:shards-1',
+            'Shards',
+            ['MultiLevelSensor'],
+            description
+        )
+        self.ioloop = tornado.ioloop.IOLoop.current()
+        self.device_manager = device_manager
+        self.device_manager.add_change_listener(self.on_value_changed)
+
+        self.shards = Value(self.__shard_map)
+        self.add_property(
+            Property(self,
+                     'shards',
+                     self.shards,
+                     metadata={
+                         'title': 'shards',
+                         "type": "string",
+                         'description': 'comma separated list of device name to shard assignments',
+                         'readOnly': True,
+                     }))
+
+    @property
+    def __shard_map(self) -> str:
+        return ", ".join([name + ": " + str(shard) for name, shard in sorted(self.device_manager.shard_assignments().items())])
+
+    def on_value_changed(self):
+        self.ioloop.add_callback(self._on_value_changed)
+
+    def _on_value_changed(self):
+        self.shards.notify_of_external_update(self.__shard_map)
+
+
+def shard_address(base_port: int, shard: int) -> Tuple[str, int]:
+    return "localhost", base_port + shard
+
+
+def run_shard(directory: str, port: int, shard: int, num_shards: int, base_port: int, authkey: bytes, record_directory: Optional[str] = None):
+    from rule_engine import RuleEngine, run_webthing_server
+    from websocket_consumer import EventConsumer
+    from event_recorder import EventRecorder
+
+    logging.basicConfig(format='%(asctime)s shard' + str(shard) + ' %(name)-20s: %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+    if record_directory is not None:
+        # each shard records the events of its devices
+        shard_record_directory = join(record_directory, "shard" + str(shard))
+        logging.info('recording device events (dir: ' + shard_record_directory + ')')
+        EventConsumer.recorder = EventRecorder(shard_record_directory)
+    shard_map = ShardMap(num_shards)
+    clients = {other: ShardClient(other, shard_address(base_port, other), authkey) for other in range(num_shards) if other != shard}
+    device_manager = ShardDeviceManager(directory, shard, shard_map, clients)
+    ShardServer(shard_address(base_port, shard), authkey, device_manager).start()
+    # the primary shard processes all rules except the 'Property changed' rules of devices connected to other shards
+    primary = shard == 0
+    rule_engine = RuleEngine(directory, device_manager, InvokerManager(), primary=primary)
+    # the coordinator stops the shards by SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        rule_engine.start()
+        if primary:
+            run_webthing_server("", port, device_manager, rule_engine.invocation_manager, [ShardThing("", device_manager)])
+        else:
+            while True:
+                sleep(60)
+    finally:
+        EventConsumer.close_recorder()
+
+
+class ShardCoordinator:
+
+    def __init__(self, directory: str, port: int, num_shards: int, base_port: int = 9600, record_directory: Optional[str] = None):
+        self.directory = directory
+        self.record_directory = record_directory
+        self.port = port
+        self.num_shards = num_shards
+        self.base_port = base_port
+        self.__is_running = False
+        self.__authkey = os.urandom(32)
+        self.__processes: Dict[int, Process] = {}
+
+    def start(self):
+        self.__is_running = True
+        for shard in range(self.num_shards):
+            self.__start_shard(shard)
+        logging.info(str(self.num_shards) + " shards started")
+
+    def __start_shard(self, shard: int):
+        process = Process(target=run_shard, args=(self.directory, self.port, shard, self.num_shards, self.base_port, self.__authkey, self.record_directory), daemon=True)
+        process.start()
+        self.__processes[shard] = process
+
+    def stop(self):
+        self.__is_running = False
+        for process in self.__processes.values():
+            process.terminate()
+        # the shards close their event recorders on termination
+        for process in self.__processes.values():
+            process.join(timeout=10)
+        logging.info("shards stopped")
+
+    def supervise(self):
+        while self.__is_running:
+            sleep(5)
+            for shard, process in list(self.__processes.items()):
+                if self.__is_running and not process.is_alive():
+                    logging.warning("shard " + str(shard) + " terminated (exit code " + str(process.exitcode) + "). Restarting shard")
+                    self.__start_shard(shard)
+
+
+def run_sharded_server(directory: str, port: int, num_shards: int, record_directory: Optional[str] = None):
+    coordinator = ShardCoordinator(directory, port, num_shards, record_directory=record_directory)
+    try:
+        logging.info('starting sharded rule engine (rules dir: ' + directory + ', shards: ' + str(num_shards) + ')')
+        coordinator.start()
+        coordinator.supervise()
+    except KeyboardInterrupt:
+        logging.info('stopping sharded rule engine')
+        coordinator.stop()
+        logging.info('done')
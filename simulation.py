@@ -0,0 +1,146 @@
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from clock import VirtualClock
+from device import Device, DeviceRegistry, Store
+from invoke import InvokerManager, Invocation
+from rule_engine import RuleEngine
+
+
+
+class SimulatedDevice(Device):
+
+    def __init__(self, name: str, properties: Dict[str, Any], simulation):
+        super().__init__(name)
+        self._properties.update(properties)
+        self.__simulation = simulation
+
+    def on_property_changed(self, properties: Dict[str, Any]):
+        props_changed = {name: value for name, value in properties.items() if self._properties.get(name, None) != value}
+        props_old = {name: self._properties[name] for name in props_changed.keys() if name in self._properties}
+        self._properties.update(properties)
+        self._notify_listener(props_changed, props_old)
+
+    def set_property(self, prop_name: str, value: Any, reason: str = None):
+        if self._properties.get(prop_name, None) != value:
+            self.__simulation.on_write(self.name, prop_name, value, reason)
+            old_value = self._properties.get(prop_name, None)
+            self._properties[prop_name] = value
+            self._notify_listener({prop_name: value}, {prop_name: old_value})
+
+
+class SimulatedDeviceManager(DeviceRegistry):
+
+    def __init__(self, devices: Dict[str, Dict[str, Any]], simulation):
+        self.__change_listeners = set()
+        self.__device_map = {name: SimulatedDevice(name, properties, simulation) for name, properties in devices.items()}
+        if Store.NAME not in self.__device_map.keys():
+            self.__device_map[Store.NAME] = SimulatedDevice(Store.NAME, {}, simulation)
+
+    def add_change_listener(self, change_listener):
+        self.__change_listeners.add(change_listener)
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def devices(self) -> List[Device]:
+        return list(self.__device_map.values())
+
+    def device(self, name: str) -> Optional[Device]:
+        return self.__device_map.get(name, None)
+
+
+class SimulatedInvokerManager(InvokerManager):
+
+    def __init__(self, simulation):
+        super().__init__(num_runners=0)
+        self.__simulation = simulation
+        self.__pending = deque()
+
+    def start(self):
+        pass
+
+    def invoke_async(self, invocation: Invocation):
+        self.__pending.append(invocation)
+
+    def run_pending(self):
+        # in order of submission, like the runners of the InvokerManager. Cascades are bounded by the cascade monitor
+        while len(self.__pending) > 0:
+            invocation = self.__pending.popleft()
+            self.__simulation.on_invocation(str(invocation), invocation.initiator)
+            self._execute(invocation, 0)
+
+
+class SimulationReport:
+
+    def __init__(self):
+        self.invocations: List[Tuple[datetime, str, str]] = []
+        self.writes: List[Tuple[datetime, str, str, Any, Optional[str]]] = []
+
+    def invocation_counts(self) -> Dict[str, int]:
+        counts = {}
+        for _, rule, _ in self.invocations:
+            counts[rule] = counts.get(rule, 0) + 1
+        return counts
+
+    def __str__(self):
+        return str(len(self.invocations)) + " invocations (" + ", ".join([rule + ": " + str(count) for rule, count in sorted(self.invocation_counts().items())]) + "), " + \
+               str(len(self.writes)) + " writes"
+
+
+class Simulation:
+    """
+    Runs the rules of a directory against in-memory devices on a virtual clock. A trace of
+    (time, device name, property name, value) events is replayed as fast as possible
+
+    Examples:
+        .. code-block::
+            simulation = Simulation("rules", {"energy": {"pv": 0}}, datetime(2024, 6, 1))
+            report = simulation.run([(datetime(2024, 6, 1, 9, 0), "energy", "pv", 3400)], until=datetime(2024, 6, 8))
+    """
+
+    def __init__(self, directory: str, devices: Dict[str, Dict[str, Any]], start: datetime):
+        self.clock = VirtualClock(start)
+        self.report = SimulationReport()
+        self.device_manager = SimulatedDeviceManager(devices, self)
+        self.invoker_manager = SimulatedInvokerManager(self)
+        self.rule_engine = RuleEngine(directory, self.device_manager, self.invoker_manager, self.clock)
+
+    def on_invocation(self, rule: str, initiator: str):
+        self.report.invocations.append((self.clock.now(), rule, initiator))
+
+    def on_write(self, device_name: str, prop_name: str, value: Any, reason: Optional[str]):
+        self.report.writes.append((self.clock.now(), device_name, prop_name, value, reason))
+
+    def __advance_to(self, time: datetime):
+        next_minute = self.clock.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+        while next_minute <= time:
+            self.clock.advance_to(next_minute)
+            self.rule_engine.tick()
+            self.invoker_manager.run_pending()
+            next_minute = next_minute + timedelta(minutes=1)
+        self.clock.advance_to(time)
+
+    def run(self, events: Iterable[Tuple[datetime, str, str, Any]], until: Optional[datetime] = None) -> SimulationReport:
+        self.rule_engine.start()
+        try:
+            self.rule_engine.tick()
+            self.invoker_manager.run_pending()
+            for time, device_name, prop_name, value in events:
+                self.__advance_to(time)
+                device = self.device_manager.device(device_name)
+                if device is None:
+                    logging.warning("simulated device " + device_name + " not available. Ignoring event")
+                    continue
+                device.on_property_changed({prop_name: value})
+                self.invoker_manager.run_pending()
+            if until is not None:
+                self.__advance_to(until)
+        finally:
+            self.rule_engine.stop()
+        return self.report
@@ -0,0 +1,73 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from device import Device, DeviceRegistry
+from causality import current_trace
+
+
+
+class DeviceSnapshot(Device):
+
+    def __init__(self, device: Device):
+        super().__init__(device.name)
+        self.__device = device
+        # copy-on-first-use. Reads are served by the copy and do not see concurrent changes of the stream
+        self._properties = device.cached_properties()
+        self.read_properties: Set[str] = set()
+
+    def add_listener(self, change_listener):
+        self.__device.add_listener(change_listener)
+
+    @property
+    def property_names(self) -> List[str]:
+        return self.__device.property_names
+
+    def get_property(self, prop_name: str, dflt = None, force_loading: bool = False) -> Any:
+        self.read_properties.add(prop_name)
+        if force_loading or prop_name not in self._properties:
+            value = self.__device.get_property(prop_name, force_loading=force_loading)
+            self._properties[prop_name] = value
+        else:
+            value = self._properties[prop_name]
+        if value is None:
+            return dflt
+        else:
+            return value
+
+    def set_property(self, prop_name: str, value: Any, reason: str = None):
+        trace = current_trace()
+        if trace is not None and trace.depth > 1:
+            reason = ("" if reason is None else reason + "; ") + "cascade " + str(trace)
+        self.__device.set_property(prop_name, value, reason)
+        # the write may have been failed or skipped. The value accepted by the device is used
+        accepted_value = self.__device.cached_property(prop_name)
+        if accepted_value is None:
+            self._properties.pop(prop_name, None)
+        else:
+            self._properties[prop_name] = accepted_value
+
+    def __str__(self):
+        return str(self.__device)
+
+
+class DeviceRegistrySnapshot(DeviceRegistry):
+
+    def __init__(self, device_registry: DeviceRegistry):
+        self.__device_registry = device_registry
+        self.__snapshots: Dict[str, DeviceSnapshot] = {}
+
+    def device(self, name: str) -> Optional[Device]:
+        snapshot = self.__snapshots.get(name, None)
+        if snapshot is None:
+            device = self.__device_registry.device(name)
+            if device is None:
+                return None
+            snapshot = DeviceSnapshot(device)
+            self.__snapshots[name] = snapshot
+        return snapshot
+
+    @property
+    def devices(self) -> List[Device]:
+        return [self.device(device.name) for device in self.__device_registry.devices]
+
+    @property
+    def read_properties(self) -> Set[Tuple[str, str]]:
+        return {(snapshot.name, prop_name) for snapshot in self.__snapshots.values() for prop_name in snapshot.read_properties}
@@ -1,6 +1,10 @@
+import os
+import json
 import logging
 import inspect
 import sys
+from os.path import join, dirname, exists
+from threading import Lock
 from typing import List, Dict, Any
 
 
@@ -26,4 +30,63 @@ def parse_annotations(func) -> List[str]:
             ano = line[startIdx: endIdx].strip().strip('"')
             annotations.append(ano)
             logging.debug("annotation '" + ano + "' found")
-    return annotations
\ No newline at end of file
+    return annotations
+
+
+class AnnotationCache:
+    """
+    the parsed annotations of the rule modules by function name. Parsing requires to read and tokenize the source
+    of each function. The annotations of unchanged files (same modification time and size) are reused. The cache
+    is stored next to the cached bytecode of the modules
+    """
+
+    FILENAME = "rule_annotations.json"
+
+    def __init__(self, directory: str):
+        self.__filename = join(directory, "__pycache__", self.FILENAME)
+        self.__lock = Lock()
+        self.__is_modified = False
+        self.__entries = self.__load()
+
+    def __load(self) -> Dict[str, Any]:
+        try:
+            if exists(self.__filename):
+                with open(self.__filename) as file:
+                    return json.load(file)
+        except Exception as e:
+            logging.warning("error occurred loading annotation cache " + self.__filename + " " + str(e))
+        return {}
+
+    def parse_function_annotations(self, modulename: str) -> Dict[Any, List[str]]:
+        module = sys.modules[modulename]
+        try:
+            stat = os.stat(module.__file__)
+            stamp = [stat.st_mtime_ns, stat.st_size]
+        except Exception as e:
+            return parse_function_annotations(modulename)
+
+        functions = dict(inspect.getmembers(module, inspect.isfunction))
+        entry = self.__entries.get(modulename, None)
+        if entry is not None and entry['stamp'] == stamp and entry['annotations'].keys() == functions.keys():
+            return {functions[name]: annotations for name, annotations in entry['annotations'].items()}
+
+        function_annotations = parse_function_annotations(modulename)
+        with self.__lock:
+            self.__entries[modulename] = {'stamp': stamp, 'annotations': {func.__name__: annotations for func, annotations in function_annotations.items()}}
+            self.__is_modified = True
+        return function_annotations
+
+    def save(self):
+        with self.__lock:
+            if not self.__is_modified:
+                return
+            entries = dict(self.__entries)
+            self.__is_modified = False
+        try:
+            os.makedirs(dirname(self.__filename), exist_ok=True)
+            tempfile = self.__filename + "." + str(os.getpid()) + ".tmp"
+            with open(tempfile, "w") as file:
+                json.dump(entries, file)
+            os.replace(tempfile, self.__filename)
+        except Exception as e:
+            logging.warning("error occurred saving annotation cache " + self.__filename + " " + str(e))
@@ -0,0 +1,83 @@
+import os
+import json
+import logging
+from os.path import join
+from itertools import count
+from time import time
+from threading import Lock, get_ident
+from typing import Any, Optional
+from lazy_logging import TraceSampler
+from rotating_file import RotatingFile
+
+
+
+class SpanExporter:
+    """
+    writes spans in the Chrome Trace Event format (JSON array format), which can be loaded by
+    chrome://tracing or https://ui.perfetto.dev. The closing bracket of the array is optional
+    in this format, i.e. the files can be read while they are written
+    """
+
+    def __init__(self, directory: str, max_file_size: int = 16 * 1024 * 1024, max_files: int = 5):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        self.__lock = Lock()
+        self.__file: Optional[RotatingFile] = None
+        self.__pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, span):
+        # each process (shard) writes its own file
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__file = RotatingFile(join(self.directory, "trace-" + str(os.getpid()) + ".json"), self.max_file_size, self.max_files, binary=False, header="[\n")
+                    self.__pid = os.getpid()
+        self.__file.write(json.dumps(span) + ",\n", flush=True)
+
+
+class Tracer:
+    """
+    latency tracing of sampled events. A websocket message sampled by the tracer's own sampler gets a
+    trace id, which is passed through the dispatching, the invoker queue, the rule execution and the resulting
+    property writes (see causality.current_trace_id). Each stage is exported as a span tagged with the trace id
+    """
+
+    def __init__(self):
+        self.__exporter: Optional[SpanExporter] = None
+        self.__ids = count(1)
+        # separated from the sampler of the trace log. Otherwise both would consume the same counter
+        self.__sampler = TraceSampler()
+
+    def configure(self, exporter: Optional[SpanExporter], sample_rate: float = 0):
+        self.__exporter = exporter
+        self.__sampler.set_sample_rate(sample_rate)
+        if exporter is not None:
+            logging.info("exporting spans of the sampled events (" + exporter.directory + ")" + ("" if self.__sampler.is_enabled else ". Sampling is disabled"))
+
+    def start_trace(self) -> Optional[str]:
+        # returns the trace id, if the event is sampled
+        if self.__exporter is not None and self.__sampler.is_sampled():
+            return str(os.getpid()) + "-" + str(next(self.__ids))
+        return None
+
+    def span(self, name: str, category: str, started: float, trace_id: str, **args: Any):
+        # started is the start time in epoch seconds (time.time())
+        exporter = self.__exporter
+        if exporter is not None:
+            args['trace_id'] = trace_id
+            try:
+                exporter.export({"name": name,
+                                 "cat": category,
+                                 "ph": "X",
+                                 "ts": int(started * 1000000),
+                                 "dur": int((time() - started) * 1000000),
+                                 "pid": os.getpid(),
+                                 "tid": get_ident(),
+                                 "args": args})
+            except Exception as e:
+                logging.warning("error occurred exporting span " + name + " " + str(e))
+
+
+tracer = Tracer()
@@ -1,11 +1,19 @@
 import logging
-import json
 import requests
 from websocket import create_connection
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from threading import Thread
-from time import sleep
+from datetime import datetime
+from time import sleep, time
+from tracing import tracer
+from causality import set_current_trace_id
+
+try:
+    # optional, faster json backend
+    from orjson import loads
+except ImportError:
+    from json import loads
 
 
 
@@ -15,16 +23,31 @@ class Listener(ABC):
     def on_property_changed(self, properties: Dict[str, Any]):
         pass
 
+    def on_stream_opened(self):
+        pass
+
 
 
 class EventConsumer:
 
+    # optional EventRecorder, which records each received message
+    recorder = None
+
+    PROPERTY_STATUS = "propertyStatus"
+    PROPERTY_STATUS_MARKER = '"' + PROPERTY_STATUS + '"'
+    PROPERTY_STATUS_MARKER_BYTES = PROPERTY_STATUS_MARKER.encode("utf-8")
+
     def __init__(self, name: str, uri: str, event_listener: Listener):
         self.__is_running = True
         self.__uri = uri
         self.name = name
         self.__ws_uri = None
         self.__event_listener = event_listener
+        self.connected_since: Optional[datetime] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connected_since is not None
 
     @property
     def ws_uri(self) -> str:
@@ -44,15 +67,49 @@ class EventConsumer:
     def stop(self):
         self.__is_running = False
 
+    @staticmethod
+    def close_recorder():
+        # writes the buffered records. Otherwise the last record would be truncated
+        recorder = EventConsumer.recorder
+        if recorder is not None:
+            EventConsumer.recorder = None
+            try:
+                recorder.close()
+            except Exception as e:
+                logging.warning("error occurred closing event recorder " + str(e))
+
     def on_message(self, message: str):
+        recorder = EventConsumer.recorder
+        if recorder is not None:
+            try:
+                recorder.record(self.name, message)
+            except Exception as e:
+                logging.warning(self.name + " error occurred recording message " + str(e))
+        trace_id = tracer.start_trace()
+        if trace_id is None:
+            self.__process(message)
+        else:
+            started = time()
+            # the listeners are called by this thread. They pick up the trace id
+            set_current_trace_id(trace_id)
+            try:
+                self.__process(message)
+            finally:
+                set_current_trace_id(None)
+                tracer.span("message", "websocket", started, trace_id, device=self.name, size=len(message))
+
+    def __process(self, message):
         try:
-            data = json.loads(message)
-            if data['messageType'] == 'propertyStatus':
-                self.__event_listener.on_property_changed(data['data'])
-            else:
-                logging.warning(self.name + " unknown message type received " + message)
+            # cheap pre-check to avoid parsing messages of other types
+            marker = self.PROPERTY_STATUS_MARKER if isinstance(message, str) else self.PROPERTY_STATUS_MARKER_BYTES
+            if marker in message:
+                data = loads(message)
+                if data['messageType'] == self.PROPERTY_STATUS:
+                    self.__event_listener.on_property_changed(data['data'])
+                    return
+            logging.warning(self.name + " unknown message type received " + str(message))
         except Exception as e:
-            logging.warning(self.name + " error occurred parsing message " + message + " " + str(e))
+            logging.warning(self.name + " error occurred parsing message " + str(message) + " " + str(e))
 
     def __listen(self):
         errors = 0
@@ -61,6 +118,9 @@ class EventConsumer:
             try:
                 logging.info(self.name + " opening stream " + self.ws_uri)
                 ws = create_connection(self.ws_uri)
+                self.connected_since = datetime.now()
+                # events missed while disconnected are not replayed by the device. Resync
+                self.__event_listener.on_stream_opened()
                 while self.__is_running:
                     msg = ws.recv()
                     self.on_message(msg)
@@ -69,6 +129,7 @@ class EventConsumer:
                 errors = errors + 1
                 if self.__is_running:
                     logging.warning(self.name + " error occurred running websocket client (" + self.__uri + ") " + str(e))
+            self.connected_since = None
             try:
                 ws.close()
             except Exception as e: